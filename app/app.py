@@ -5,9 +5,15 @@ Flask认证应用 - HTTP VPN系统的认证服务器
 
 from flask import Flask, request, render_template, redirect, url_for, make_response
 import jwt
+import bisect
+import fcntl
 import json
 import os
+import socket
+import threading
 import time
+import uuid
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 
 app = Flask(__name__)
@@ -23,6 +29,30 @@ USERS = {
 # 认证会话文件路径
 AUTH_SESSION_FILE = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'shared', 'auth_sessions.json')
 
+# 登录成功后跳转的转发器地址（转发器启用TLS时改为https）
+PROXY_URL = os.environ.get('PROXY_URL', 'http://localhost:5001/')
+
+# 会话事件通道目录（每个转发器在此绑定一个Unix数据报套接字）
+SESSION_EVENT_DIR = os.path.join(os.path.dirname(AUTH_SESSION_FILE), 'session_events')
+
+# 事件纪元与序号：转发器据此发现认证服务器重启或事件丢失，并回退到全量重同步
+SESSION_EVENT_EPOCH = f"{os.getpid()}-{int(time.time())}"
+session_event_seq = 0
+session_event_lock = threading.Lock()
+
+# 发送事件时等待转发器接收队列腾出空间的最长时间（秒）
+SESSION_EVENT_SEND_TIMEOUT = 0.2
+
+# 心跳间隔（秒）：事件丢失后转发器最迟在一个心跳间隔内发现并重同步
+SESSION_EVENT_HEARTBEAT_INTERVAL = float(os.environ.get('SESSION_EVENT_HEARTBEAT', 5.0))
+
+# 会话索引缓存：登录/退出后失效；转发器每秒回写的活动时间不触发重建，按TTL定期合并
+EPOCH = datetime(1970, 1, 1)
+MAX_PAGE_SIZE = 500
+SESSION_INDEX_TTL = float(os.environ.get('SESSION_INDEX_TTL', 30.0))
+session_index_cache = {'stale': True, 'built_at': 0.0, 'index': None}
+session_index_lock = threading.Lock()
+
 def load_auth_sessions():
     """加载认证会话数据"""
     try:
@@ -31,26 +61,97 @@ def load_auth_sessions():
     except (FileNotFoundError, json.JSONDecodeError):
         return {"sessions": {}, "user_mappings": {}}
 
+@contextmanager
+def session_file_lock():
+    """会话文件的读-改-写锁，与转发器回写活动时间共用同一个锁文件"""
+    os.makedirs(os.path.dirname(AUTH_SESSION_FILE), exist_ok=True)
+    with open(f"{AUTH_SESSION_FILE}.lock", 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
 def save_auth_sessions(data):
     """保存认证会话数据"""
     try:
         # 确保目录存在
         os.makedirs(os.path.dirname(AUTH_SESSION_FILE), exist_ok=True)
         
-        with open(AUTH_SESSION_FILE, 'w', encoding='utf-8') as f:
+        # 先写临时文件再原子替换，避免转发器读到写了一半的文件
+        tmp_file = f"{AUTH_SESSION_FILE}.{os.getpid()}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
             json.dump(data, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_file, AUTH_SESSION_FILE)
+        invalidate_session_index()
         return True
     except Exception as e:
         print(f"保存认证会话失败: {e}")
         return False
 
-def generate_token(username):
+def publish_session_event(event_type, **fields):
+    """向所有转发器推送会话事件（丢失的事件由转发器根据心跳发现并全量重同步弥补）"""
+    global session_event_seq
+    
+    with session_event_lock:
+        session_event_seq += 1
+        event = {'epoch': SESSION_EVENT_EPOCH, 'seq': session_event_seq, 'type': event_type}
+    event.update(fields)
+    broadcast_session_event(event)
+
+def publish_session_heartbeat():
+    """推送当前纪元和序号，转发器据此发现丢失的事件"""
+    with session_event_lock:
+        event = {'epoch': SESSION_EVENT_EPOCH, 'seq': session_event_seq, 'type': 'heartbeat'}
+    broadcast_session_event(event)
+
+def broadcast_session_event(event):
+    """向事件目录中的所有转发器套接字发送一个事件"""
+    data = json.dumps(event, ensure_ascii=False).encode('utf-8')
+    
+    try:
+        socket_names = [name for name in os.listdir(SESSION_EVENT_DIR) if name.endswith('.sock')]
+    except FileNotFoundError:
+        return
+    
+    sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    # 接收队列满时短暂阻塞等待转发器取走事件，而不是立即丢弃
+    sender.settimeout(SESSION_EVENT_SEND_TIMEOUT)
+    try:
+        for name in socket_names:
+            socket_path = os.path.join(SESSION_EVENT_DIR, name)
+            try:
+                sender.sendto(data, socket_path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # 转发器已退出，清理残留的套接字文件
+                try:
+                    os.unlink(socket_path)
+                except OSError:
+                    pass
+            except OSError as e:
+                print(f"推送会话事件失败 ({name}): {e}")
+    finally:
+        sender.close()
+
+def session_heartbeat_loop():
+    """定期推送心跳"""
+    while True:
+        time.sleep(SESSION_EVENT_HEARTBEAT_INTERVAL)
+        publish_session_heartbeat()
+
+def start_session_heartbeat():
+    """启动心跳线程"""
+    threading.Thread(target=session_heartbeat_loop, daemon=True).start()
+
+def generate_token(username, session_id=None, token_id=None):
     """生成JWT token"""
     payload = {
         'username': username,
         'target_port': USERS[username]['target_port'],
         'exp': datetime.utcnow() + timedelta(minutes=30),  # 改为30分钟
-        'iat': datetime.utcnow()
+        'iat': datetime.utcnow(),
+        'jti': token_id or uuid.uuid4().hex,  # token ID，用于无状态模式下的撤销
+        'sid': session_id
     }
     return jwt.encode(payload, app.secret_key, algorithm='HS256')
 
@@ -64,6 +165,109 @@ def verify_token(token):
     except jwt.InvalidTokenError:
         return None
 
+def record_token_revocation(auth_data, jti, timeout_minutes=30):
+    """记录被撤销的token ID，返回撤销事件附带的字段"""
+    if not jti:
+        return {}
+    
+    # 无状态模式下转发器会不断续签token，撤销记录至少保留一个超时周期
+    expires = time.time() + timeout_minutes * 60
+    auth_data.setdefault('revoked_tokens', {})[jti] = expires
+    return {'jti': jti, 'expires': expires}
+
+def prune_revoked_tokens(auth_data):
+    """清理已经失效的撤销记录"""
+    now = time.time()
+    revoked_tokens = auth_data.get('revoked_tokens', {})
+    auth_data['revoked_tokens'] = {jti: expires for jti, expires in revoked_tokens.items() if expires > now}
+
+class SessionIndex:
+    """活跃会话索引
+    
+    会话按过期时间从晚到早排序，任意时刻的活跃会话恰好是列表的前缀，
+    因此计数只需一次二分查找，分页只需切片，与会话总数无关。
+    """
+    
+    def __init__(self, auth_data):
+        self.built_at = datetime.utcnow()
+        entries = []
+        
+        for session_id, session in auth_data['sessions'].items():
+            if not session.get('active', True):
+                continue
+            try:
+                last_activity = datetime.fromisoformat(session.get('last_activity', session.get('created_at')))
+                timeout_minutes = session.get('timeout_minutes', 30)
+                entries.append((
+                    (last_activity - EPOCH).total_seconds() + timeout_minutes * 60,
+                    {
+                        'session_id': session_id,
+                        'username': session['username'],
+                        'target_port': session['target_port'],
+                        'created_at': session['created_at'],
+                        'last_activity': session.get('last_activity'),
+                        'timeout_minutes': timeout_minutes
+                    }
+                ))
+            except:
+                continue
+        
+        entries.sort(key=lambda entry: entry[0], reverse=True)
+        
+        # 全部会话及每个用户的会话，各自按过期时间降序；键取负值以便bisect
+        user_entries = {}
+        for expires_at, entry in entries:
+            user_entries.setdefault(entry['username'], []).append((expires_at, entry))
+        
+        self.all = self.build_view(entries)
+        self.by_user = {username: self.build_view(items) for username, items in user_entries.items()}
+    
+    @staticmethod
+    def build_view(entries):
+        """构建 (负过期时间列表, 会话列表) 视图"""
+        return [-expires_at for expires_at, _ in entries], [entry for _, entry in entries]
+    
+    @staticmethod
+    def active_count(view):
+        """视图中当前仍活跃的会话数"""
+        now = (datetime.utcnow() - EPOCH).total_seconds()
+        return bisect.bisect_right(view[0], -now)
+    
+    def page(self, username, offset, limit):
+        """返回 (当前页会话列表, 匹配的活跃会话总数)"""
+        view = self.by_user.get(username, ([], [])) if username else self.all
+        total_count = self.active_count(view)
+        return view[1][offset:min(offset + limit, total_count)], total_count
+    
+    def count_by_user(self):
+        """每个用户的活跃会话数"""
+        counts = {username: self.active_count(view) for username, view in self.by_user.items()}
+        return {username: count for username, count in sorted(counts.items()) if count}
+
+def invalidate_session_index():
+    """会话增删后标记索引需要重建"""
+    session_index_cache['stale'] = True
+
+def get_session_index():
+    """获取会话索引，仅在登录/退出之后或超过TTL时重建"""
+    with session_index_lock:
+        if (session_index_cache['index'] is None or
+            session_index_cache['stale'] or
+            time.monotonic() - session_index_cache['built_at'] > SESSION_INDEX_TTL):
+            session_index_cache['stale'] = False
+            session_index_cache['index'] = SessionIndex(load_auth_sessions())
+            session_index_cache['built_at'] = time.monotonic()
+        return session_index_cache['index']
+
+def get_page_args(default_limit):
+    """解析分页参数 offset/limit"""
+    try:
+        offset = max(0, int(request.args.get('offset', 0)))
+        limit = min(MAX_PAGE_SIZE, max(1, int(request.args.get('limit', default_limit))))
+    except ValueError:
+        offset, limit = 0, default_limit
+    return offset, limit
+
 @app.route('/')
 def index():
     """首页 - 显示登录页面"""
@@ -79,62 +283,82 @@ def login():
     if username not in USERS or USERS[username]['password'] != password:
         return render_template('login.html', error="用户名或密码错误")
     
-    # 生成JWT token
-    token = generate_token(username)
-    
-    # 加载现有的认证会话
-    auth_data = load_auth_sessions()
-    
-    # 踢出该用户的所有现有会话（实现单用户登录）
-    sessions_to_remove = []
-    for session_id_old, session in auth_data['sessions'].items():
-        if session.get('username') == username:
-            sessions_to_remove.append(session_id_old)
-    
-    for session_id_old in sessions_to_remove:
-        del auth_data['sessions'][session_id_old]
-        print(f"踢出用户 {username} 的旧会话: {session_id_old}")
-    
-    # 创建会话ID
+    # 创建会话ID并生成JWT token
     session_id = f"session_{username}_{int(time.time())}"
-    current_time = datetime.utcnow()
-    
-    # 添加新的认证会话（使用滑动超时）
-    auth_data['sessions'][session_id] = {
-        'username': username,
-        'token': token,
-        'target_port': USERS[username]['target_port'],
-        'created_at': current_time.isoformat(),
-        'last_activity': current_time.isoformat(),  # 新增：最后活动时间
-        'timeout_minutes': 30,  # 新增：超时时间（分钟）
-        'active': True
-    }
+    token_id = uuid.uuid4().hex
+    token = generate_token(username, session_id, token_id)
     
-    # 清理所有过期的会话（使用滑动超时）
-    expired_sessions = []
-    for sid, session in auth_data['sessions'].items():
-        try:
-            last_activity = datetime.fromisoformat(session.get('last_activity', session.get('created_at')))
-            timeout_minutes = session.get('timeout_minutes', 30)
-            if (current_time - last_activity).total_seconds() > timeout_minutes * 60:
+    with session_file_lock():
+        # 加载现有的认证会话（持锁直到保存，避免与转发器的活动回写互相覆盖）
+        auth_data = load_auth_sessions()
+        prune_revoked_tokens(auth_data)
+        
+        # 踢出该用户的所有现有会话（实现单用户登录）
+        sessions_to_remove = []
+        for session_id_old, session in auth_data['sessions'].items():
+            if session.get('username') == username:
+                sessions_to_remove.append(session_id_old)
+        
+        revoked_sessions = []
+        for session_id_old in sessions_to_remove:
+            del auth_data['sessions'][session_id_old]
+            revoked_sessions.append((session_id_old, username, {}))
+            print(f"踢出用户 {username} 的旧会话: {session_id_old}")
+        
+        # 撤销该用户上一次登录的token（会话记录可能已被清理，但token仍可能被转发器续签）
+        user_tokens = auth_data.setdefault('user_tokens', {})
+        previous_token_id = user_tokens.get(username)
+        if previous_token_id:
+            revoked_sessions.append((None, username, record_token_revocation(auth_data, previous_token_id)))
+        user_tokens[username] = token_id
+        
+        current_time = datetime.utcnow()
+        
+        # 添加新的认证会话（使用滑动超时）
+        auth_data['sessions'][session_id] = {
+            'username': username,
+            'token': token,
+            'target_port': USERS[username]['target_port'],
+            'created_at': current_time.isoformat(),
+            'last_activity': current_time.isoformat(),  # 新增：最后活动时间
+            'timeout_minutes': 30,  # 新增：超时时间（分钟）
+            'active': True,
+            'jti': token_id
+        }
+        
+        # 清理所有过期的会话（使用滑动超时）
+        expired_sessions = []
+        for sid, session in auth_data['sessions'].items():
+            try:
+                last_activity = datetime.fromisoformat(session.get('last_activity', session.get('created_at')))
+                timeout_minutes = session.get('timeout_minutes', 30)
+                if (current_time - last_activity).total_seconds() > timeout_minutes * 60:
+                    expired_sessions.append(sid)
+            except:
                 expired_sessions.append(sid)
-        except:
-            expired_sessions.append(sid)
-    
-    for sid in expired_sessions:
-        if sid in auth_data['sessions']:
-            expired_username = auth_data['sessions'][sid].get('username', 'unknown')
-            del auth_data['sessions'][sid]
-            print(f"清理过期会话: {sid} (用户: {expired_username})")
+        
+        for sid in expired_sessions:
+            if sid in auth_data['sessions']:
+                expired_username = auth_data['sessions'][sid].get('username', 'unknown')
+                del auth_data['sessions'][sid]
+                revoked_sessions.append((sid, expired_username, {}))
+                print(f"清理过期会话: {sid} (用户: {expired_username})")
+        
+        # 保存认证会话
+        saved = save_auth_sessions(auth_data)
     
-    # 保存认证会话
-    if not save_auth_sessions(auth_data):
+    if not saved:
         return render_template('login.html', error="认证会话保存失败，请重试")
     
+    # 通知转发器：先撤销旧会话，再下发新会话
+    for sid, revoked_username, revocation in revoked_sessions:
+        publish_session_event('revoke', session_id=sid, username=revoked_username, **revocation)
+    publish_session_event('create', session_id=session_id, session=auth_data['sessions'][session_id])
+    
     print(f"用户 {username} 登录成功，会话ID: {session_id}")
     
     # 设置Cookie并直接跳转到转发器根路径（用户容器）
-    response = make_response(redirect('http://localhost:5001/'))
+    response = make_response(redirect(PROXY_URL))
     response.set_cookie(
         'auth_token', 
         token, 
@@ -159,13 +383,30 @@ def logout():
     """用户退出登录"""
     session_id = request.cookies.get('session_id')
     
-    if session_id:
+    # 从token中取出会话ID和token ID（无状态模式下token可能已被转发器续签）
+    token_payload = {}
+    token = request.cookies.get('auth_token')
+    if token:
+        try:
+            token_payload = jwt.decode(token, app.secret_key, algorithms=['HS256'],
+                                       options={'verify_exp': False})
+        except jwt.InvalidTokenError:
+            token_payload = {}
+    session_id = session_id or token_payload.get('sid')
+    
+    if session_id or token_payload.get('jti'):
         # 从认证会话中移除
-        auth_data = load_auth_sessions()
-        if session_id in auth_data['sessions']:
-            username = auth_data['sessions'][session_id]['username']
-            del auth_data['sessions'][session_id]
-            save_auth_sessions(auth_data)
+        with session_file_lock():
+            auth_data = load_auth_sessions()
+            session = auth_data['sessions'].pop(session_id, None) if session_id else None
+            username = (session or token_payload).get('username')
+            token_id = token_payload.get('jti') or (session or {}).get('jti')
+            revocation = record_token_revocation(auth_data, token_id)
+            if session or revocation:
+                save_auth_sessions(auth_data)
+        
+        if session or revocation:
+            publish_session_event('revoke', session_id=session_id, username=username, **revocation)
             print(f"用户 {username} 已退出登录，会话ID: {session_id}")
     
     # 清除Cookie并跳转回登录页面
@@ -201,97 +442,56 @@ def api_verify_token():
 
 @app.route('/api/get_user_sessions')
 def api_get_user_sessions():
-    """API: 获取当前活跃的用户会话（供调试使用）"""
-    auth_data = load_auth_sessions()
-    active_sessions = {}
+    """API: 获取当前活跃的用户会话（供调试使用，支持 username/offset/limit 分页过滤）"""
+    username = request.args.get('username') or None
+    offset, limit = get_page_args(default_limit=100)
     
-    current_time = datetime.utcnow()
-    for session_id, session in auth_data['sessions'].items():
-        try:
-            last_activity = datetime.fromisoformat(session.get('last_activity', session.get('created_at')))
-            timeout_minutes = session.get('timeout_minutes', 30)
-            if ((current_time - last_activity).total_seconds() <= timeout_minutes * 60 and 
-                session.get('active', True)):
-                active_sessions[session_id] = {
-                    'username': session['username'],
-                    'target_port': session['target_port'],
-                    'created_at': session['created_at'],
-                    'last_activity': session.get('last_activity'),
-                    'timeout_minutes': timeout_minutes
-                }
-        except:
-            continue
+    index = get_session_index()
+    page, total_count = index.page(username, offset, limit)
+    
+    return {
+        "active_sessions": {
+            entry['session_id']: {key: value for key, value in entry.items() if key != 'session_id'}
+            for entry in page
+        },
+        "total_count": total_count,
+        "offset": offset,
+        "limit": limit,
+        "username": username
+    }
+
+@app.route('/api/sessions/summary')
+def api_sessions_summary():
+    """API: 活跃会话汇总（开销与会话总数无关，适合监控轮询）"""
+    index = get_session_index()
+    by_user = index.count_by_user()
     
     return {
-        "active_sessions": active_sessions,
-        "total_count": len(active_sessions)
+        "total_active": sum(by_user.values()),
+        "by_user": by_user,
+        "index_built_at": index.built_at.isoformat()
     }
 
 @app.route('/status')
 def status():
-    """系统状态页面"""
-    auth_data = load_auth_sessions()
-    active_sessions = []
+    """系统状态页面（分页显示活跃会话，可按用户过滤）"""
+    username = request.args.get('username') or None
+    offset, limit = get_page_args(default_limit=50)
     
-    current_time = datetime.utcnow()
-    for session_id, session in auth_data['sessions'].items():
-        try:
-            last_activity = datetime.fromisoformat(session.get('last_activity', session.get('created_at')))
-            timeout_minutes = session.get('timeout_minutes', 30)
-            if ((current_time - last_activity).total_seconds() <= timeout_minutes * 60 and 
-                session.get('active', True)):
-                active_sessions.append({
-                    'session_id': session_id,
-                    'username': session['username'],
-                    'target_port': session['target_port'],
-                    'created_at': session['created_at'],
-                    'last_activity': session.get('last_activity'),
-                    'timeout_minutes': timeout_minutes
-                })
-        except:
-            continue
+    index = get_session_index()
+    page, filtered_count = index.page(username, offset, limit)
+    by_user = index.count_by_user()
     
-    status_html = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>HTTP VPN 系统状态</title>
-        <style>
-            body {{ font-family: Arial, sans-serif; margin: 40px; }}
-            .container {{ max-width: 800px; margin: 0 auto; }}
-            .session {{ background: #f0f0f0; padding: 15px; margin: 10px 0; border-radius: 5px; }}
-            .header {{ background: #333; color: white; padding: 20px; border-radius: 5px; margin-bottom: 20px; }}
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <div class="header">
-                <h1>HTTP VPN 系统状态</h1>
-                <p>当前活跃会话: {len(active_sessions)}</p>
-            </div>
-            
-            <h2>活跃会话列表</h2>
-            {"".join([f'''
-            <div class="session">
-                <strong>用户:</strong> {s['username']}<br>
-                <strong>目标端口:</strong> {s['target_port']}<br>
-                <strong>会话ID:</strong> {s['session_id']}<br>
-                <strong>创建时间:</strong> {s['created_at']}<br>
-                <strong>最后活动:</strong> {s['last_activity']}<br>
-                <strong>超时时间:</strong> {s['timeout_minutes']}分钟
-            </div>
-            ''' for s in active_sessions])}
-            
-            <div style="margin-top: 30px;">
-                <a href="/">返回登录页面</a> | 
-                <a href="/api/get_user_sessions">API接口</a>
-            </div>
-        </div>
-    </body>
-    </html>
-    """
-    
-    return status_html
+    return render_template(
+        'status.html',
+        sessions=page,
+        total_active=sum(by_user.values()),
+        by_user=by_user,
+        filtered_count=filtered_count,
+        username=username,
+        offset=offset,
+        limit=limit
+    )
 
 if __name__ == '__main__':
     print("=" * 60)
@@ -307,4 +507,10 @@ if __name__ == '__main__':
     print("认证会话文件:", AUTH_SESSION_FILE)
     print("=" * 60)
     
-    app.run(host='0.0.0.0', port=3001, debug=True) 
\ No newline at end of file
+    debug = True
+    
+    # 调试模式下由重载器启动的子进程处理请求，心跳只在该进程中发送
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_session_heartbeat()
+    
+    app.run(host='0.0.0.0', port=3001, debug=debug) 
\ No newline at end of file
@@ -217,10 +217,10 @@ MALICIOUS_PATHS=(
     "/app"
 )
 
-for PATH in "${MALICIOUS_PATHS[@]}"; do
-    echo -n "测试路径: $PATH: "
+for TEST_PATH in "${MALICIOUS_PATHS[@]}"; do
+    echo -n "测试路径: $TEST_PATH: "
     
-    RESPONSE=$(curl -s -w "%{http_code}" "http://localhost:5001$PATH" -o /dev/null)
+    RESPONSE=$(curl -s -w "%{http_code}" "http://localhost:5001$TEST_PATH" -o /dev/null)
     if [ "$RESPONSE" = "401" ]; then
         print_success "路径遍历被认证拦截"
     elif [ "$RESPONSE" = "404" ]; then
@@ -230,6 +230,97 @@ for PATH in "${MALICIOUS_PATHS[@]}"; do
     fi
 done
 
+# 攻击测试9: 慢速请求头攻击 (Slowloris)
+print_test_header "9" "慢速请求头攻击 (Slowloris)"
+print_info "每秒发送一行请求头，检查转发器是否在读取请求头时限内断开连接..."
+
+# 管理接口只允许容器内回环地址访问，需通过docker exec调用
+read_header_timeouts() {
+    docker exec http-vpn-proxy curl -s http://127.0.0.1:5001/_dockergate/timeouts 2>/dev/null | \
+        python3 -c "import json, sys; data = json.load(sys.stdin); print(data['$1']['header_read'])" 2>/dev/null
+}
+
+HEADER_TIMEOUT=$(read_header_timeouts config)
+COUNT_BEFORE=$(read_header_timeouts counters)
+
+if [ -z "$HEADER_TIMEOUT" ] || [ -z "$COUNT_BEFORE" ]; then
+    print_info "跳过慢速请求头测试 (无法通过docker exec读取超时统计)"
+else
+    print_info "读取请求头时限: ${HEADER_TIMEOUT}秒"
+    
+    # 持续发送不完整的请求头，直到连接被关闭或超过时限10秒，输出连接存活的秒数
+    ELAPSED=$(python3 - "$HEADER_TIMEOUT" <<'PYEOF'
+import socket, sys, time
+limit = float(sys.argv[1])
+sock = socket.create_connection(('127.0.0.1', 5001))
+sock.sendall(b"GET / HTTP/1.1\r\nHost: localhost\r\n")
+start = time.monotonic()
+sock.settimeout(1)
+while time.monotonic() - start < limit + 10:
+    try:
+        sock.sendall(b"X-Slow: 1\r\n")
+        sock.recv(1024)
+        break
+    except socket.timeout:
+        continue
+    except OSError:
+        break
+print(f"{time.monotonic() - start:.1f}")
+PYEOF
+)
+    COUNT_AFTER=$(read_header_timeouts counters)
+    
+    echo -n "连接存活时间 ${ELAPSED}秒: "
+    if python3 -c "import sys; sys.exit(0 if float('$ELAPSED') <= float('$HEADER_TIMEOUT') + 2 else 1)"; then
+        print_success "慢速连接在读取请求头时限内被关闭"
+    else
+        print_failure "慢速连接未在读取请求头时限内被关闭"
+    fi
+    
+    echo -n "header_read超时计数 ${COUNT_BEFORE} → ${COUNT_AFTER}: "
+    if [ -n "$COUNT_AFTER" ] && [ "$COUNT_AFTER" -gt "$COUNT_BEFORE" ]; then
+        print_success "超时已计入 /_dockergate/timeouts"
+    else
+        print_failure "超时未计入 /_dockergate/timeouts"
+    fi
+fi
+
+# 攻击测试10: 单用户突发请求攻击
+print_test_header "10" "单用户突发请求攻击"
+print_info "用同一用户的token并发发送超过突发上限的请求，检查是否被限流..."
+
+if [ -n "$VALID_TOKEN" ]; then
+    USER_BURST=$(docker exec http-vpn-proxy printenv USER_BURST 2>/dev/null)
+    USER_BURST=${USER_BURST:-40}
+    BURST_REQUESTS=$((USER_BURST * 2 + 20))
+    print_info "突发上限: ${USER_BURST}，并发发送 ${BURST_REQUESTS} 个请求"
+    
+    rm -f temp_burst_*.txt
+    seq 1 "$BURST_REQUESTS" | xargs -P 20 -I{} \
+        curl -s -o /dev/null -D temp_burst_{}.txt http://localhost:5001/ -H "Cookie: auth_token=$VALID_TOKEN"
+    
+    LIMITED_FILES=$(grep -l "^HTTP/1.1 429" temp_burst_*.txt 2>/dev/null)
+    LIMITED_COUNT=$(echo "$LIMITED_FILES" | grep -c . )
+    
+    echo -n "返回429的请求数 ${LIMITED_COUNT}/${BURST_REQUESTS}: "
+    if [ "$LIMITED_COUNT" -gt 0 ]; then
+        print_success "超出突发上限的请求被限流"
+    else
+        print_failure "突发请求未被限流"
+    fi
+    
+    echo -n "429响应的Retry-After头: "
+    if [ -n "$LIMITED_FILES" ] && grep -qi "^Retry-After: [0-9]" $LIMITED_FILES; then
+        print_success "429响应带有Retry-After"
+    else
+        print_failure "429响应缺少Retry-After"
+    fi
+    
+    rm -f temp_burst_*.txt
+else
+    print_info "跳过突发请求测试 (无有效token)"
+fi
+
 # 清理临时文件
 rm -f temp_cookies.txt temp_response.txt
 
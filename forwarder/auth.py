@@ -3,19 +3,42 @@
 认证模块 - 处理JWT token验证和会话管理
 """
 
+import fcntl
 import jwt
 import json
 import os
 import re
-from datetime import datetime
-from typing import Optional, Dict, Any
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any, Tuple
+from .revocation import RevocationSet
 
 class AuthManager:
     """认证管理器"""
     
-    def __init__(self, secret_key: str, auth_session_file: str):
+    def __init__(self, secret_key: str, auth_session_file: str, stateless: bool = False,
+                 session_timeout_minutes: int = 30, token_refresh_interval: int = 60):
         self.secret_key = secret_key
         self.auth_session_file = auth_session_file
+        
+        # 无状态校验模式：只依赖JWT和撤销集合，滑动超时通过刷新短期token实现
+        self.stateless = stateless
+        self.session_timeout_minutes = session_timeout_minutes
+        self.token_refresh_interval = token_refresh_interval
+        self.revocation_set = RevocationSet()
+        
+        # 内存会话缓存（由会话事件通道启用，None表示每次读取会话文件）
+        self.session_cache: Optional[Dict[str, Any]] = None
+        self.token_index: Dict[str, str] = {}
+        self.dirty_sessions = set()
+        self.activity_pending = threading.Event()
+        self.cache_lock = threading.Lock()
+        
+        # 事件序号跟踪，用于发现丢失的事件
+        self.event_epoch: Optional[str] = None
+        self.event_seq = 0
     
     def load_auth_sessions(self) -> Dict[str, Any]:
         """加载认证会话数据"""
@@ -25,32 +48,231 @@ class AuthManager:
         except (FileNotFoundError, json.JSONDecodeError):
             return {"sessions": {}, "user_mappings": {}}
     
+    @contextmanager
+    def session_file_lock(self):
+        """会话文件的读-改-写锁，与认证服务器共用同一个锁文件（不可嵌套获取）"""
+        os.makedirs(os.path.dirname(self.auth_session_file), exist_ok=True)
+        with open(f"{self.auth_session_file}.lock", 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    
     def save_auth_sessions(self, data: Dict[str, Any]) -> bool:
         """保存认证会话数据"""
         try:
             os.makedirs(os.path.dirname(self.auth_session_file), exist_ok=True)
-            with open(self.auth_session_file, 'w', encoding='utf-8') as f:
+            # 先写临时文件再原子替换，避免读取方看到写了一半的文件
+            tmp_file = f"{self.auth_session_file}.{os.getpid()}.tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
                 json.dump(data, f, indent=2, ensure_ascii=False)
+            os.replace(tmp_file, self.auth_session_file)
             return True
         except Exception as e:
             print(f"保存认证会话失败: {e}")
             return False
     
+    def enable_session_cache(self):
+        """启用内存会话缓存并执行一次全量同步"""
+        with self.cache_lock:
+            self.session_cache = {"sessions": {}, "user_mappings": {}}
+        self.resync_sessions()
+    
+    def resync_sessions(self) -> bool:
+        """从会话文件全量重建内存会话缓存"""
+        try:
+            with open(self.auth_session_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            data = {"sessions": {}, "user_mappings": {}}
+        except json.JSONDecodeError as e:
+            print(f"会话文件解析失败，保留现有缓存: {e}")
+            return False
+        
+        data.setdefault('sessions', {})
+        data.setdefault('user_mappings', {})
+        self.revocation_set.replace(data.get('revoked_tokens', {}))
+        
+        with self.cache_lock:
+            if self.session_cache is None:
+                return False
+            
+            # 保留尚未回写的活动时间，避免重同步把滑动超时倒回去
+            for session_id in self.dirty_sessions:
+                old_session = self.session_cache['sessions'].get(session_id)
+                new_session = data['sessions'].get(session_id)
+                if old_session and new_session:
+                    new_session['last_activity'] = max(
+                        old_session.get('last_activity', ''),
+                        new_session.get('last_activity', '')
+                    )
+                    if not old_session.get('active', True):
+                        new_session['active'] = False
+            
+            self.session_cache = data
+            self.token_index = {
+                session.get('token'): session_id
+                for session_id, session in data['sessions'].items()
+                if session.get('token')
+            }
+            self.dirty_sessions &= set(data['sessions'])
+        
+        print(f"会话缓存全量同步完成，共 {len(data['sessions'])} 个会话")
+        return True
+    
+    def apply_session_event(self, event: Dict[str, Any]):
+        """应用认证服务器推送的会话事件"""
+        epoch = event.get('epoch')
+        seq = event.get('seq', 0)
+        event_type = event.get('type')
+        
+        if event_type == 'heartbeat':
+            self.apply_session_heartbeat(epoch, seq)
+            return
+        
+        with self.cache_lock:
+            if self.session_cache is None:
+                return
+            
+            # 认证服务器重启或事件丢失时需要全量重同步
+            need_resync = (
+                event_type == 'resync' or
+                (self.event_epoch is not None and
+                 (epoch != self.event_epoch or seq != self.event_seq + 1))
+            )
+            self.event_epoch = epoch
+            self.event_seq = seq
+            
+            if not need_resync:
+                sessions = self.session_cache['sessions']
+                session_id = event.get('session_id')
+                
+                if event_type == 'create' and session_id and event.get('session'):
+                    session = event['session']
+                    sessions[session_id] = session
+                    self.token_index[session.get('token')] = session_id
+                    print(f"[会话事件] 新会话 {session_id} (用户: {session.get('username')})")
+                elif event_type == 'revoke' and (session_id or event.get('jti')):
+                    if event.get('jti'):
+                        self.revocation_set.add(event['jti'], event.get('expires', 0))
+                    session = sessions.pop(session_id, None)
+                    if session:
+                        self.token_index.pop(session.get('token'), None)
+                    self.dirty_sessions.discard(session_id)
+                    print(f"[会话事件] 撤销会话 {session_id} (用户: {event.get('username')})")
+                else:
+                    need_resync = True
+        
+        if need_resync:
+            self.resync_sessions()
+    
+    def apply_session_heartbeat(self, epoch: str, seq: int):
+        """心跳携带认证服务器当前的纪元和最新序号，纪元变化或序号超前说明有事件丢失"""
+        with self.cache_lock:
+            if self.session_cache is None:
+                return
+            
+            # 心跳可能与事件交错到达，序号落后于已应用的事件不算丢失
+            need_resync = epoch != self.event_epoch or seq > self.event_seq
+            if need_resync:
+                self.event_epoch = epoch
+                self.event_seq = seq
+        
+        if need_resync:
+            print("[会话事件] 心跳显示有事件丢失，执行全量重同步")
+            self.resync_sessions()
+    
+    def flush_session_activity(self):
+        """将内存中更新过的活动时间回写到会话文件"""
+        with self.cache_lock:
+            if self.session_cache is None or not self.dirty_sessions:
+                return
+            
+            updates = {}
+            for session_id in self.dirty_sessions:
+                session = self.session_cache['sessions'].get(session_id)
+                if session:
+                    updates[session_id] = (session.get('last_activity'), session.get('active', True))
+            self.dirty_sessions = set()
+        
+        with self.session_file_lock():
+            auth_sessions = self.load_auth_sessions()
+            changed = False
+            for session_id, (last_activity, active) in updates.items():
+                session = auth_sessions['sessions'].get(session_id)
+                if session:
+                    session['last_activity'] = last_activity
+                    session['active'] = active
+                    changed = True
+            
+            if changed:
+                self.save_auth_sessions(auth_sessions)
+    
+    def find_cached_session(self, token: str) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        """按token查找内存中的会话"""
+        session_id = self.token_index.get(token)
+        if session_id is None:
+            return None, None
+        return session_id, self.session_cache['sessions'].get(session_id)
+    
+    def authenticate_cached(self, username: str, token: str) -> Optional[Dict[str, Any]]:
+        """基于内存会话缓存检查滑动超时并更新活动时间"""
+        current_time = datetime.utcnow()
+        
+        with self.cache_lock:
+            session_id, session = self.find_cached_session(token)
+            if (not session or
+                session.get('username') != username or
+                not session.get('active', True)):
+                return None
+            
+            try:
+                last_activity = datetime.fromisoformat(session.get('last_activity', session.get('created_at')))
+            except (TypeError, ValueError):
+                return None
+            timeout_minutes = session.get('timeout_minutes', 30)
+            
+            if (current_time - last_activity).total_seconds() > timeout_minutes * 60:
+                print(f"用户 {username} 的会话已超时 ({timeout_minutes}分钟)")
+                session['active'] = False
+                self.dirty_sessions.add(session_id)
+                self.activity_pending.set()
+                return None
+            
+            # 更新最后活动时间，由回写线程异步批量写入会话文件
+            session['last_activity'] = current_time.isoformat()
+            self.dirty_sessions.add(session_id)
+            self.activity_pending.set()
+            return session
+    
+    def get_sessions_snapshot(self) -> Dict[str, Any]:
+        """获取会话数据（缓存启用时不读取会话文件）"""
+        with self.cache_lock:
+            if self.session_cache is not None:
+                return {
+                    "sessions": dict(self.session_cache['sessions']),
+                    "user_mappings": self.session_cache['user_mappings']
+                }
+        return self.load_auth_sessions()
+    
     def update_session_activity(self, username: str, token: str) -> bool:
         """更新会话活动时间"""
-        auth_sessions = self.load_auth_sessions()
         current_time = datetime.utcnow()
         
-        for session_id, session in auth_sessions['sessions'].items():
-            if (session.get('username') == username and 
-                session.get('token') == token and 
-                session.get('active', True)):
-                
-                # 更新最后活动时间
-                session['last_activity'] = current_time.isoformat()
-                self.save_auth_sessions(auth_sessions)
-                print(f"更新用户 {username} 的活动时间: {current_time.isoformat()}")
-                return True
+        with self.session_file_lock():
+            auth_sessions = self.load_auth_sessions()
+            
+            for session_id, session in auth_sessions['sessions'].items():
+                if (session.get('username') == username and 
+                    session.get('token') == token and 
+                    session.get('active', True)):
+                    
+                    # 更新最后活动时间
+                    session['last_activity'] = current_time.isoformat()
+                    self.save_auth_sessions(auth_sessions)
+                    print(f"更新用户 {username} 的活动时间: {current_time.isoformat()}")
+                    return True
         
         return False
     
@@ -106,34 +328,58 @@ class AuthManager:
             print("Token验证失败")
             return None
         
-        # 检查会话是否仍然活跃
-        auth_sessions = self.load_auth_sessions()
         username = payload.get('username')
         
-        # 查找对应的活跃会话（使用滑动超时）
-        active_session = None
-        current_time = datetime.utcnow()
+        # 无状态模式：签名和exp已由JWT校验，只需检查撤销集合
+        if self.stateless:
+            jti = payload.get('jti')
+            if not jti:
+                print(f"用户 {username} 的Token缺少jti，无法在无状态模式下校验")
+                return None
+            if self.revocation_set.is_revoked(jti):
+                print(f"用户 {username} 的Token已被撤销: {jti}")
+                return None
+            
+            print(f"用户 {username} 认证成功(无状态)，目标端口: {payload.get('target_port')}")
+            return payload
         
-        for session_id, session in auth_sessions['sessions'].items():
-            if (session.get('username') == username and 
-                session.get('token') == token and 
-                session.get('active', True)):
-                
-                try:
-                    # 使用滑动超时检查
-                    last_activity = datetime.fromisoformat(session.get('last_activity', session.get('created_at')))
-                    timeout_minutes = session.get('timeout_minutes', 30)
+        # 会话缓存启用时完全在内存中完成检查
+        if self.session_cache is not None:
+            if not self.authenticate_cached(username, token):
+                print(f"未找到用户 {username} 的活跃会话")
+                return None
+            
+            print(f"用户 {username} 认证成功，目标端口: {payload.get('target_port')}")
+            return payload
+        
+        # 检查会话是否仍然活跃
+        with self.session_file_lock():
+            auth_sessions = self.load_auth_sessions()
+            
+            # 查找对应的活跃会话（使用滑动超时）
+            active_session = None
+            current_time = datetime.utcnow()
+            
+            for session_id, session in auth_sessions['sessions'].items():
+                if (session.get('username') == username and 
+                    session.get('token') == token and 
+                    session.get('active', True)):
                     
-                    if (current_time - last_activity).total_seconds() <= timeout_minutes * 60:
-                        active_session = session
-                        break
-                    else:
-                        print(f"用户 {username} 的会话已超时 ({timeout_minutes}分钟)")
-                        # 标记会话为非活跃
-                        session['active'] = False
-                        self.save_auth_sessions(auth_sessions)
-                except:
-                    continue
+                    try:
+                        # 使用滑动超时检查
+                        last_activity = datetime.fromisoformat(session.get('last_activity', session.get('created_at')))
+                        timeout_minutes = session.get('timeout_minutes', 30)
+                        
+                        if (current_time - last_activity).total_seconds() <= timeout_minutes * 60:
+                            active_session = session
+                            break
+                        else:
+                            print(f"用户 {username} 的会话已超时 ({timeout_minutes}分钟)")
+                            # 标记会话为非活跃
+                            session['active'] = False
+                            self.save_auth_sessions(auth_sessions)
+                    except:
+                        continue
         
         if not active_session:
             print(f"未找到用户 {username} 的活跃会话")
@@ -145,6 +391,24 @@ class AuthManager:
         print(f"用户 {username} 认证成功，目标端口: {payload.get('target_port')}")
         return payload
     
+    def refresh_token(self, payload: Dict[str, Any]) -> Optional[str]:
+        """无状态模式下按需签发新的短期token，实现滑动超时
+        
+        token签发超过刷新间隔后才重新签发，返回None表示无需刷新。
+        """
+        if not self.stateless:
+            return None
+        
+        issued_at = payload.get('iat', 0)
+        if time.time() - issued_at < self.token_refresh_interval:
+            return None
+        
+        current_time = datetime.utcnow()
+        new_payload = dict(payload)
+        new_payload['iat'] = current_time
+        new_payload['exp'] = current_time + timedelta(minutes=self.session_timeout_minutes)
+        return jwt.encode(new_payload, self.secret_key, algorithm='HS256')
+    
     def clean_request(self, request_data: str) -> str:
         """清理HTTP请求，移除认证信息"""
         
@@ -178,7 +442,7 @@ class AuthManager:
     
     def get_user_target_port(self, username: str) -> Optional[int]:
         """获取用户对应的目标端口"""
-        auth_sessions = self.load_auth_sessions()
+        auth_sessions = self.get_sessions_snapshot()
         
         # 从user_mappings中获取
         if username in auth_sessions.get('user_mappings', {}):
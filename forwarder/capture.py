@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+流量采集 - 以追加方式记录匿名化的请求元数据，供 replay_traffic.py 回放
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from typing import Dict, Any, Optional
+
+class TrafficRecorder:
+    """请求元数据采集器
+
+    每个请求写一行JSON（短字段名）：
+      ts 开始时间  m 方法  p 匿名化路径  u 用户分桶  rq 请求字节数  ck Cookie字节数
+      bs 请求体字节数  st 状态码  rs 响应字节数  d 耗时(毫秒)  f 是否为该会话的首个请求
+    路径的每一段用加盐哈希替换（保留扩展名），查询串只保留参数个数，不记录任何token。
+    """
+
+    def __init__(self, user_buckets: int = 64):
+        self.user_buckets = user_buckets
+        self.path: Optional[str] = None
+        self.file = None
+        self.salt = b''
+        self.seen_sessions = set()
+        self.records = 0
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    @property
+    def active(self) -> bool:
+        return self.file is not None
+
+    def start(self, path: str) -> Dict[str, Any]:
+        """开始采集，追加写入path"""
+        with self.lock:
+            if self.file:
+                self.file.close()
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            self.path = path
+            self.file = open(path, 'a', encoding='utf-8')
+            self.salt = os.urandom(16)
+            self.seen_sessions = set()
+            self.records = 0
+
+        print(f"[流量采集] 开始写入 {path}")
+        return self.status()
+
+    def stop(self) -> Dict[str, Any]:
+        """停止采集"""
+        with self.lock:
+            if self.file:
+                self.file.close()
+                self.file = None
+                print(f"[流量采集] 已停止，共 {self.records} 条记录")
+        return self.status()
+
+    def status(self) -> Dict[str, Any]:
+        """返回当前状态"""
+        return {'active': self.active, 'path': self.path, 'records': self.records}
+
+    def begin(self):
+        """请求开始（在处理线程中调用）"""
+        self.local.record = {'ts': time.time()} if self.active else None
+
+    def note_request(self, method: str, path: str, request_data: str):
+        """记录请求行和大小"""
+        record = getattr(self.local, 'record', None)
+        if record is None:
+            return
+
+        headers, _, body = request_data.partition('\r\n\r\n')
+        cookie_match = re.search(r'^Cookie:(.*)$', headers, re.IGNORECASE | re.MULTILINE)
+
+        record['m'] = method
+        record['p'] = self.anonymize_path(path)
+        record['rq'] = len(request_data)
+        record['ck'] = len(cookie_match.group(1).strip()) if cookie_match else 0
+        record['bs'] = len(body)
+
+    def note_user(self, username: str, session_key: Optional[str]):
+        """记录用户分桶以及是否为该会话在本次采集中的首个请求"""
+        record = getattr(self.local, 'record', None)
+        if record is None:
+            return
+
+        record['u'] = self.bucket(username)
+        if session_key:
+            session_hash = self.digest(session_key)
+            with self.lock:
+                first = session_hash not in self.seen_sessions
+                self.seen_sessions.add(session_hash)
+            if first:
+                record['f'] = 1
+
+    def note_response(self, data: bytes):
+        """记录发往客户端的响应（可能分多次调用）"""
+        record = getattr(self.local, 'record', None)
+        if record is None:
+            return
+
+        if 'st' not in record:
+            status_line = data[:data.find(b"\r\n")].decode('utf-8', errors='ignore').split(' ')
+            if len(status_line) >= 2 and status_line[1].isdigit():
+                record['st'] = int(status_line[1])
+        record['rs'] = record.get('rs', 0) + len(data)
+
+    def finish(self):
+        """请求结束，写入记录"""
+        record = getattr(self.local, 'record', None)
+        self.local.record = None
+        if record is None or 'm' not in record:
+            return
+
+        record['d'] = round((time.time() - record['ts']) * 1000, 2)
+        record['ts'] = round(record['ts'], 3)
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+
+        with self.lock:
+            if self.file:
+                self.file.write(line)
+                self.file.flush()
+                self.records += 1
+
+    def digest(self, value: str) -> str:
+        """加盐哈希，结果只在本次采集内稳定"""
+        return hashlib.blake2s(value.encode('utf-8'), key=self.salt, digest_size=4).hexdigest()
+
+    def bucket(self, username: str) -> int:
+        """把用户名映射到固定数量的分桶"""
+        return int(self.digest(username), 16) % self.user_buckets
+
+    def anonymize_path(self, path: str) -> str:
+        """逐段哈希路径，保留层级、扩展名和查询参数个数"""
+        path, _, query = path.partition('?')
+        segments = []
+        for segment in path.split('/'):
+            if not segment:
+                segments.append(segment)
+                continue
+            name, dot, extension = segment.rpartition('.')
+            if dot and name and len(extension) <= 5:
+                segments.append(f"{self.digest(name)}.{extension}")
+            else:
+                segments.append(self.digest(segment))
+
+        anonymized = '/'.join(segments) or '/'
+        if query:
+            anonymized += f"?q{len(query.split('&'))}"
+        return anonymized
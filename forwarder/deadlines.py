@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+分阶段超时控制 - 为请求的每个阶段设置总时限，防御慢速客户端
+"""
+
+import os
+import socket
+import threading
+import time
+from typing import Dict, Mapping
+
+class PhaseTimeouts:
+    """各阶段超时配置（秒）"""
+
+    PHASES = ('header_read', 'body_read', 'upstream_connect', 'upstream_response', 'client_write')
+
+    def __init__(self, header_read: float = 10.0, body_read: float = 30.0,
+                 upstream_connect: float = 3.0, upstream_response: float = 30.0,
+                 client_write: float = 30.0):
+        self.header_read = header_read
+        self.body_read = body_read
+        self.upstream_connect = upstream_connect
+        self.upstream_response = upstream_response
+        self.client_write = client_write
+
+    @classmethod
+    def from_env(cls, environ: Mapping[str, str] = os.environ) -> 'PhaseTimeouts':
+        """从环境变量读取配置，如 TIMEOUT_HEADER_READ=5"""
+        timeouts = cls()
+        for phase in cls.PHASES:
+            value = environ.get(f"TIMEOUT_{phase.upper()}")
+            if value:
+                setattr(timeouts, phase, float(value))
+        return timeouts
+
+class Deadline:
+    """某个阶段的截止时间
+
+    与逐次recv的settimeout不同，截止时间覆盖整个阶段，
+    每字节间隔很长的慢速客户端也无法无限期占用连接。
+    """
+
+    def __init__(self, phase: str, seconds: float):
+        self.phase = phase
+        self.expires = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        """剩余时间（秒）"""
+        return self.expires - time.monotonic()
+
+    def apply(self, sock: socket.socket):
+        """按剩余时间设置套接字超时，已超时则直接抛出socket.timeout"""
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise socket.timeout(f"{self.phase} deadline exceeded")
+        sock.settimeout(remaining)
+
+class TimeoutCounters:
+    """各阶段超时次数统计"""
+
+    def __init__(self):
+        self.counts: Dict[str, int] = {phase: 0 for phase in PhaseTimeouts.PHASES}
+        self.lock = threading.Lock()
+
+    def increment(self, phase: str):
+        """记录一次超时"""
+        with self.lock:
+            self.counts[phase] = self.counts.get(phase, 0) + 1
+
+    def snapshot(self) -> Dict[str, int]:
+        """返回统计快照"""
+        with self.lock:
+            return dict(self.counts)
+
+class ClientWriteError(Exception):
+    """向客户端写响应失败（超时或连接断开）
+
+    响应可能已经部分写出，调用方不能再向该连接发送任何错误响应，只能关闭连接。
+    """
+
+def send_with_deadline(sock: socket.socket, data: bytes, deadline: Deadline, chunk_size: int = 65536):
+    """在截止时间内发送全部数据，超时抛出socket.timeout"""
+    view = memoryview(data)
+    while view:
+        deadline.apply(sock)
+        sent = sock.send(view[:chunk_size])
+        view = view[sent:]
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+在线性能诊断 - 按采样率对请求做cProfile，并在限定时间窗口内跟踪内存分配
+"""
+
+import cProfile
+import io
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from typing import Dict, Any, List, Optional
+
+# 诊断窗口的上限，避免误传的参数让分析长期开启
+MAX_DURATION = 600.0
+MAX_FRAMES = 50
+
+class RequestProfiler:
+    """采样请求分析器
+
+    窗口期内每N个请求分析1个，窗口结束时合并所有样本写入
+    .prof文件（可用pstats/snakeviz查看）和按累计耗时排序的文本摘要。
+    """
+
+    def __init__(self, output_dir: str, max_samples: int = 1000):
+        self.output_dir = output_dir
+        self.max_samples = max_samples
+
+        self.active = False
+        self.sample_every = 100
+        self.request_count = 0
+        self.samples: List[cProfile.Profile] = []
+        self.timer: Optional[threading.Timer] = None
+        self.last_output: Optional[str] = None
+        self.lock = threading.Lock()
+
+        # cProfile同一时间只能有一个分析器处于启用状态，样本逐个采集
+        self.profile_lock = threading.Lock()
+
+    def start(self, sample_every: int = 100, duration: float = 60.0) -> Dict[str, Any]:
+        """开启采样窗口，duration秒后自动结束并输出结果（最长MAX_DURATION秒）"""
+        duration = min(max(1.0, duration), MAX_DURATION)
+        with self.lock:
+            if self.timer:
+                self.timer.cancel()
+            self.active = True
+            self.sample_every = max(1, sample_every)
+            self.request_count = 0
+            self.samples = []
+            self.timer = threading.Timer(duration, self.stop)
+            self.timer.daemon = True
+            self.timer.start()
+
+        print(f"[性能分析] 开始采样: 每 {self.sample_every} 个请求分析1个，持续 {duration} 秒")
+        return self.status()
+
+    def stop(self) -> Dict[str, Any]:
+        """结束采样窗口并输出结果"""
+        with self.lock:
+            if self.timer:
+                self.timer.cancel()
+                self.timer = None
+            was_active = self.active
+            self.active = False
+            samples = self.samples
+            self.samples = []
+
+        if was_active:
+            self.last_output = self.dump(samples)
+        return self.status()
+
+    def run(self, func, *args):
+        """执行func，命中采样时在cProfile下执行"""
+        if not self.active:
+            return func(*args)
+
+        with self.lock:
+            self.request_count += 1
+            sampled = (self.active and
+                       self.request_count % self.sample_every == 0 and
+                       len(self.samples) < self.max_samples)
+
+        if not sampled or not self.profile_lock.acquire(blocking=False):
+            return func(*args)
+
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(func, *args)
+        finally:
+            self.profile_lock.release()
+            with self.lock:
+                self.samples.append(profile)
+
+    def dump(self, samples: List[cProfile.Profile]) -> Optional[str]:
+        """合并样本并写入文件，返回.prof文件路径"""
+        if not samples:
+            print("[性能分析] 采样窗口内没有样本")
+            return None
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        base_name = os.path.join(self.output_dir, f"profile-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}")
+
+        stats = pstats.Stats(samples[0])
+        for profile in samples[1:]:
+            stats.add(profile)
+        stats.dump_stats(f"{base_name}.prof")
+
+        summary = io.StringIO()
+        pstats.Stats(f"{base_name}.prof", stream=summary).sort_stats('cumulative').print_stats(40)
+        with open(f"{base_name}.txt", 'w', encoding='utf-8') as f:
+            f.write(f"样本数: {len(samples)}\n\n")
+            f.write(summary.getvalue())
+
+        print(f"[性能分析] 已输出 {len(samples)} 个样本: {base_name}.prof")
+        return f"{base_name}.prof"
+
+    def status(self) -> Dict[str, Any]:
+        """返回当前状态"""
+        with self.lock:
+            return {
+                'active': self.active,
+                'sample_every': self.sample_every,
+                'requests_seen': self.request_count,
+                'samples': len(self.samples),
+                'last_output': self.last_output
+            }
+
+class MemoryTracer:
+    """限时内存分配跟踪
+
+    窗口开始和结束时各拍一次tracemalloc快照，输出两个快照文件
+    和按分配增量排序的文本摘要，窗口结束后停止跟踪以免持续产生开销。
+    """
+
+    def __init__(self, output_dir: str):
+        self.output_dir = output_dir
+        self.start_snapshot: Optional[tracemalloc.Snapshot] = None
+        self.timer: Optional[threading.Timer] = None
+        self.last_output: Optional[str] = None
+        self.lock = threading.Lock()
+
+    def start(self, duration: float = 60.0, frames: int = 10) -> Dict[str, Any]:
+        """开始跟踪，duration秒后自动结束并输出结果（最长MAX_DURATION秒，最多MAX_FRAMES层调用栈）"""
+        duration = min(max(1.0, duration), MAX_DURATION)
+        frames = min(max(1, frames), MAX_FRAMES)
+        with self.lock:
+            if self.timer:
+                self.timer.cancel()
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(frames)
+            self.start_snapshot = tracemalloc.take_snapshot()
+            self.timer = threading.Timer(duration, self.stop)
+            self.timer.daemon = True
+            self.timer.start()
+
+        print(f"[内存跟踪] 开始跟踪，持续 {duration} 秒")
+        return self.status()
+
+    def stop(self) -> Dict[str, Any]:
+        """结束跟踪并输出结果"""
+        with self.lock:
+            if self.timer:
+                self.timer.cancel()
+                self.timer = None
+            start_snapshot = self.start_snapshot
+            self.start_snapshot = None
+
+            if start_snapshot is None or not tracemalloc.is_tracing():
+                return self.status_locked()
+
+            end_snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+
+        self.last_output = self.dump(start_snapshot, end_snapshot)
+        return self.status()
+
+    def dump(self, start_snapshot: tracemalloc.Snapshot, end_snapshot: tracemalloc.Snapshot) -> str:
+        """写入快照和分配增量摘要，返回摘要文件路径"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        base_name = os.path.join(self.output_dir, f"tracemalloc-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}")
+
+        start_snapshot.dump(f"{base_name}-start.snapshot")
+        end_snapshot.dump(f"{base_name}-end.snapshot")
+
+        with open(f"{base_name}.txt", 'w', encoding='utf-8') as f:
+            f.write("分配增量最多的位置:\n")
+            for stat in end_snapshot.compare_to(start_snapshot, 'lineno')[:30]:
+                f.write(f"{stat}\n")
+            f.write("\n当前占用最多的位置:\n")
+            for stat in end_snapshot.statistics('lineno')[:30]:
+                f.write(f"{stat}\n")
+
+        print(f"[内存跟踪] 已输出: {base_name}.txt")
+        return f"{base_name}.txt"
+
+    def status(self) -> Dict[str, Any]:
+        """返回当前状态"""
+        with self.lock:
+            return self.status_locked()
+
+    def status_locked(self) -> Dict[str, Any]:
+        """返回当前状态（调用方需持有锁）"""
+        tracing = tracemalloc.is_tracing()
+        return {
+            'active': self.start_snapshot is not None,
+            'traced_memory': tracemalloc.get_traced_memory() if tracing else None,
+            'last_output': self.last_output
+        }
@@ -7,43 +7,153 @@ import socket
 import threading
 import re
 import os
+import json
+import math
 import time
-from typing import Optional, Tuple
+from urllib.parse import parse_qs
+from typing import Optional, Tuple, Dict, List
 from .auth import AuthManager
+from .session_events import SessionEventListener
+from .upstream import CircuitBreaker, UpstreamHealthChecker, UpstreamPool
+from .deadlines import PhaseTimeouts, Deadline, TimeoutCounters, ClientWriteError, send_with_deadline
+from .scheduling import UserRateLimiter, FairScheduler
+from .restart import inherited_listen_socket, notify_ready, spawn_successor
+from .profiling import RequestProfiler, MemoryTracer
+from .tls import TLSTerminator
+from .capture import TrafficRecorder
+
+# 与Web应用共享的JWT签名密钥
+SECRET_KEY = "http-vpn-secret-key-change-this-in-production"
 
 class HTTPVPNProxy:
     """HTTP VPN 代理服务器"""
     
-    def __init__(self, listen_port: int = 5000):
+    def __init__(self, listen_port: int = 5000, stateless_sessions: bool = False,
+                 admin_allow: Tuple[str, ...] = ('127.0.0.1', '::1'),
+                 timeouts: Optional[PhaseTimeouts] = None,
+                 rate_limiter: Optional[UserRateLimiter] = None,
+                 scheduler: Optional[FairScheduler] = None,
+                 max_connections: int = 256,
+                 max_connections_per_ip: int = 32,
+                 upstream_routes: Optional[Dict[int, List[Tuple[str, int]]]] = None,
+                 sticky_sessions: bool = False,
+                 drain_timeout: float = 25.0,
+                 tls: Optional[TLSTerminator] = None,
+                 capture_file: Optional[str] = None,
+                 shared_dir: Optional[str] = None,
+                 embedded: bool = False):
         self.listen_port = listen_port
-        self.secret_key = "http-vpn-secret-key-change-this-in-production"
+        
+        # 嵌入模式（供回放工具等在进程内使用）：不继承监听套接字、不写PID文件，
+        # 不启用会话事件通道和健康检查，避免影响同一主机上正在运行的转发器
+        self.embedded = embedded
+        self.secret_key = SECRET_KEY
         self.running = True
         
+        # 可选的TLS终结
+        self.tls = tls
+        
+        # 分阶段超时配置及超时统计
+        self.timeouts = timeouts or PhaseTimeouts()
+        self.timeout_counters = TimeoutCounters()
+        
+        # 优雅停止：进行中的连接数及排空时限
+        self.drain_timeout = drain_timeout
+        self.active_connections = 0
+        self.connections_idle = threading.Condition()
+        self.server_socket = None
+        self.successor_pid = None
+        
+        # 按用户限流与公平调度，以及全局连接数上限
+        self.rate_limiter = rate_limiter or UserRateLimiter()
+        self.scheduler = scheduler or FairScheduler()
+        self.connection_slots = threading.BoundedSemaphore(max_connections)
+        
+        # 单个来源地址的连接数上限：连接在读完请求头、完成认证之前就占用槽位，
+        # 不限制来源时一个客户端用慢速连接即可占满全部槽位
+        self.max_connections_per_ip = max_connections_per_ip
+        self.connections_by_ip: Dict[str, int] = {}
+        
+        # 允许访问管理接口(/_dockergate/...)的客户端地址
+        self.admin_allow = set(admin_allow)
+        
+        # 端口到容器副本的映射（每个用户路由可以有多个副本）
+        if upstream_routes is None:
+            upstream_routes = {
+                6060: [('nginx-user-aaa', 80)],
+                8080: [('nginx-user-bbb', 80)],
+                9090: [('nginx-user-ccc', 80)]
+            }
+        self.sticky_sessions = sticky_sessions
+        
+        # 每个上游副本一个熔断器，并由健康检查线程主动探测
+        self.upstream_breakers = {
+            replica: CircuitBreaker(f"{replica[0]}:{replica[1]}")
+            for replicas in upstream_routes.values()
+            for replica in replicas
+        }
+        self.upstream_pools = {
+            target_port: UpstreamPool(f"route-{target_port}", replicas, self.upstream_breakers)
+            for target_port, replicas in upstream_routes.items()
+        }
+        self.health_checker = UpstreamHealthChecker(self.upstream_breakers)
+        
         # 认证会话文件路径
-        auth_session_file = os.path.join(
-            os.path.dirname(os.path.dirname(__file__)), 
-            'shared', 
-            'auth_sessions.json'
-        )
+        if shared_dir is None:
+            shared_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'shared')
+        auth_session_file = os.path.join(shared_dir, 'auth_sessions.json')
         
         # 初始化认证管理器
-        self.auth_manager = AuthManager(self.secret_key, auth_session_file)
+        self.auth_manager = AuthManager(self.secret_key, auth_session_file, stateless=stateless_sessions)
+        
+        # 会话事件通道：认证服务器推送会话变更，转发器无需轮询会话文件
+        self.session_events = SessionEventListener(
+            self.auth_manager,
+            os.path.join(os.path.dirname(auth_session_file), 'session_events')
+        )
+        
+        # 在线性能诊断，结果写入共享目录便于在宿主机查看
+        profile_dir = os.path.join(os.path.dirname(auth_session_file), 'profiles')
+        self.profiler = RequestProfiler(profile_dir)
+        self.memory_tracer = MemoryTracer(profile_dir)
+        
+        # 流量采集（默认关闭），采集文件供 replay_traffic.py 回放
+        self.capture_dir = os.path.join(os.path.dirname(auth_session_file), 'captures')
+        self.recorder = TrafficRecorder()
+        if capture_file:
+            self.recorder.start(capture_file)
         
         print(f"认证会话文件: {auth_session_file}")
     
     def start(self):
         """启动代理服务器"""
-        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        # 热重启时直接使用旧进程交出的监听套接字，监听不中断
+        server_socket = None if self.embedded else inherited_listen_socket()
+        inherited = server_socket is not None
+        if not inherited:
+            server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server_socket = server_socket
         
         try:
-            server_socket.bind(('0.0.0.0', self.listen_port))
-            server_socket.listen(10)
+            if not inherited:
+                server_socket.bind(('0.0.0.0', self.listen_port))
+                server_socket.listen(10)
+            
+            # accept定期超时返回，使stop()能及时生效
+            server_socket.settimeout(1.0)
+            
+            if not self.embedded:
+                if not self.session_events.start() and self.auth_manager.stateless:
+                    # 撤销集合只能通过事件通道及时更新，没有通道时退出登录和踢出都不会生效
+                    print("会话事件通道不可用，停用无状态会话校验模式，改为每次请求读取会话文件")
+                    self.auth_manager.stateless = False
+                self.health_checker.start()
             
             print("=" * 60)
             print("HTTP VPN 转发器启动成功 (简化模式)")
             print("=" * 60)
-            print(f"监听端口: {self.listen_port}")
+            print(f"监听端口: {self.listen_port} ({'HTTPS' if self.tls else 'HTTP'})")
             print("用户路由映射:")
             print("  aaa → nginx-user-aaa:80 (容器内部)")
             print("  bbb → nginx-user-bbb:80 (容器内部)")
@@ -61,18 +171,37 @@ class HTTPVPNProxy:
             print("  2. 登录成功后直接显示用户专属容器内容")
             print("=" * 60)
             
+            if not self.embedded:
+                notify_ready()
+            
             while self.running:
+                if self.tls:
+                    self.tls.maybe_reload()
+                
                 try:
                     client_socket, client_addr = server_socket.accept()
                     
+                    # 连接数达到全局或单个来源地址的上限时直接拒绝，避免处理线程无限增长
+                    # 启动线程前计数，排空时不会漏掉刚接受、线程尚未运行的连接
+                    if not self.admit_connection(client_addr[0]):
+                        self.reject_connection(client_socket)
+                        continue
+                    
                     # 为每个客户端创建处理线程
                     client_thread = threading.Thread(
-                        target=self.handle_client,
+                        target=self.run_client,
                         args=(client_socket, client_addr),
                         daemon=True
                     )
-                    client_thread.start()
+                    try:
+                        client_thread.start()
+                    except RuntimeError:
+                        self.finish_connection(client_addr[0])
+                        client_socket.close()
+                        raise
                     
+                except socket.timeout:
+                    continue
                 except Exception as e:
                     print(f"接受连接时出错: {e}")
                     
@@ -80,9 +209,88 @@ class HTTPVPNProxy:
             print(f"服务器启动失败: {e}")
         finally:
             server_socket.close()
+            self.server_socket = None
+            self.drain_connections()
+            self.session_events.stop()
+            self.health_checker.stop()
+            self.recorder.stop()
+    
+    def drain_connections(self):
+        """停止接受新连接后，等待进行中的请求在排空时限内完成"""
+        deadline = time.monotonic() + self.drain_timeout
+        with self.connections_idle:
+            if self.active_connections:
+                print(f"等待 {self.active_connections} 个进行中的请求完成 (最多 {self.drain_timeout} 秒)...")
+            
+            while self.active_connections:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    print(f"排空超时，仍有 {self.active_connections} 个请求未完成")
+                    break
+                self.connections_idle.wait(remaining)
+    
+    def run_client(self, client_socket: socket.socket, client_addr: Tuple[str, int]):
+        """处理线程入口（连接已在accept循环中计数），结束时归还连接槽位"""
+        try:
+            # TLS握手在处理线程中完成，不阻塞accept循环
+            if self.tls:
+                client_socket = self.tls.wrap(client_socket)
+                if client_socket is None:
+                    return
+            
+            self.profiler.run(self.handle_client, client_socket, client_addr)
+        finally:
+            self.finish_connection(client_addr[0])
+    
+    def admit_connection(self, client_ip: str) -> bool:
+        """为新连接占用全局槽位和来源地址配额，任一已满时返回False"""
+        with self.connections_idle:
+            if self.connections_by_ip.get(client_ip, 0) >= self.max_connections_per_ip:
+                return False
+            if not self.connection_slots.acquire(blocking=False):
+                return False
+            self.connections_by_ip[client_ip] = self.connections_by_ip.get(client_ip, 0) + 1
+            self.active_connections += 1
+            return True
+    
+    def finish_connection(self, client_ip: str):
+        """归还连接槽位和来源地址配额，最后一个连接结束时唤醒排空等待"""
+        self.connection_slots.release()
+        with self.connections_idle:
+            remaining = self.connections_by_ip.get(client_ip, 1) - 1
+            if remaining > 0:
+                self.connections_by_ip[client_ip] = remaining
+            else:
+                self.connections_by_ip.pop(client_ip, None)
+            self.active_connections -= 1
+            if not self.active_connections:
+                self.connections_idle.notify_all()
+    
+    def reject_connection(self, client_socket: socket.socket):
+        """连接数超限时在accept线程上快速拒绝，不能阻塞accept循环
+
+        明文端口直接以非阻塞方式写出503（响应很小，一次send即可写入套接字缓冲区）；
+        TLS端口在未握手的连接上无法返回HTTP响应，直接关闭连接。
+        """
+        try:
+            if not self.tls:
+                body = b"<h1>503 Service Unavailable</h1>"
+                client_socket.setblocking(False)
+                client_socket.send(
+                    b"HTTP/1.1 503 Service Unavailable\r\n"
+                    b"Content-Type: text/html\r\n"
+                    b"Content-Length: " + str(len(body)).encode() + b"\r\n"
+                    b"Connection: close\r\n"
+                    b"\r\n" + body
+                )
+        except OSError:
+            pass
+        finally:
+            client_socket.close()
     
     def handle_client(self, client_socket: socket.socket, client_addr: Tuple[str, int]):
         """处理客户端连接"""
+        self.recorder.begin()
         try:
             # 接收HTTP请求
             request_data = self.receive_http_request(client_socket)
@@ -99,6 +307,12 @@ class HTTPVPNProxy:
                 self.send_404_response(client_socket)
                 return
             
+            if path.startswith('/_dockergate/'):
+                self.handle_admin_request(client_socket, client_addr, path)
+                return
+            
+            self.recorder.note_request(method, path, request_data)
+            
             # 认证请求
             auth_payload = self.auth_manager.authenticate_request(request_data)
             if not auth_payload:
@@ -116,10 +330,29 @@ class HTTPVPNProxy:
                 return
             
             print(f"[路由成功] {username} → 127.0.0.1:{target_port}")
+            self.recorder.note_user(username, auth_payload.get('sid') or auth_payload.get('jti'))
             
-            # 清理请求并转发
-            clean_request = self.auth_manager.clean_request(request_data)
-            self.forward_to_container(client_socket, target_port, clean_request, username)
+            # 按用户限流
+            retry_after = self.rate_limiter.allow(username)
+            if retry_after:
+                print(f"[限流] 用户 {username} 请求过于频繁")
+                self.send_too_many_requests_response(client_socket, retry_after)
+                return
+            
+            # 在用户之间公平分配转发槽位
+            if not self.scheduler.acquire(username):
+                print(f"[限流] 用户 {username} 并发请求过多")
+                self.send_too_many_requests_response(client_socket, 1)
+                return
+            
+            try:
+                # 清理请求并转发
+                clean_request = self.auth_manager.clean_request(request_data)
+                refreshed_token = self.auth_manager.refresh_token(auth_payload)
+                self.forward_to_container(client_socket, target_port, clean_request, username,
+                                          refreshed_token, auth_payload.get('sid'))
+            finally:
+                self.scheduler.release(username)
             
         except Exception as e:
             print(f"处理客户端请求时出错: {e}")
@@ -128,14 +361,89 @@ class HTTPVPNProxy:
                 client_socket.close()
             except:
                 pass
+            self.recorder.finish()
+    
+    def handle_admin_request(self, client_socket: socket.socket, client_addr: Tuple[str, int], path: str):
+        """处理管理接口请求（仅允许指定地址访问）"""
+        if client_addr[0] not in self.admin_allow:
+            print(f"[管理接口] 拒绝来自 {client_addr[0]} 的访问: {path}")
+            self.send_404_response(client_socket)
+            return
+        
+        route, _, query_string = path.partition('?')
+        query = {key: values[-1] for key, values in parse_qs(query_string).items()}
+        
+        if route == '/_dockergate/upstreams':
+            self.send_json_response(client_socket, {
+                str(target_port): pool.snapshot()
+                for target_port, pool in self.upstream_pools.items()
+            })
+        elif route == '/_dockergate/users':
+            snapshot = self.scheduler.snapshot()
+            with self.rate_limiter.lock:
+                rate_limited = dict(self.rate_limiter.rejected)
+            for username, count in rate_limited.items():
+                snapshot['users'].setdefault(username, {'active': 0, 'queued': 0, 'rejected': 0})
+                snapshot['users'][username]['rate_limited'] = count
+            self.send_json_response(client_socket, snapshot)
+        elif route == '/_dockergate/timeouts':
+            self.send_json_response(client_socket, {
+                'config': {phase: getattr(self.timeouts, phase) for phase in PhaseTimeouts.PHASES},
+                'counters': self.timeout_counters.snapshot()
+            })
+        elif route == '/_dockergate/tls':
+            self.send_json_response(client_socket, self.tls.snapshot() if self.tls else {'enabled': False})
+        elif route == '/_dockergate/capture':
+            self.send_json_response(client_socket, self.recorder.status())
+        elif route == '/_dockergate/capture/start':
+            capture_file = os.path.join(self.capture_dir, f"capture-{time.strftime('%Y%m%d-%H%M%S')}.jsonl")
+            self.send_json_response(client_socket, self.recorder.start(capture_file))
+        elif route == '/_dockergate/capture/stop':
+            self.send_json_response(client_socket, self.recorder.stop())
+        elif route == '/_dockergate/profile':
+            self.send_json_response(client_socket, self.profiler.status())
+        elif route == '/_dockergate/profile/start':
+            try:
+                sample_every = int(query.get('every', 100))
+                duration = self.parse_seconds(query.get('seconds', 60))
+            except ValueError:
+                self.send_error_response(client_socket, 400, "Bad Request")
+                return
+            self.send_json_response(client_socket, self.profiler.start(sample_every=sample_every, duration=duration))
+        elif route == '/_dockergate/profile/stop':
+            self.send_json_response(client_socket, self.profiler.stop())
+        elif route == '/_dockergate/tracemalloc':
+            self.send_json_response(client_socket, self.memory_tracer.status())
+        elif route == '/_dockergate/tracemalloc/start':
+            try:
+                duration = self.parse_seconds(query.get('seconds', 60))
+                frames = int(query.get('frames', 10))
+            except ValueError:
+                self.send_error_response(client_socket, 400, "Bad Request")
+                return
+            self.send_json_response(client_socket, self.memory_tracer.start(duration=duration, frames=frames))
+        elif route == '/_dockergate/tracemalloc/stop':
+            self.send_json_response(client_socket, self.memory_tracer.stop())
+        else:
+            self.send_404_response(client_socket)
+    
+    @staticmethod
+    def parse_seconds(value) -> float:
+        """解析管理接口的秒数参数，非数字或非有限值抛出ValueError"""
+        seconds = float(value)
+        if not math.isfinite(seconds):
+            raise ValueError(f"invalid seconds: {value}")
+        return seconds
     
     def receive_http_request(self, client_socket: socket.socket) -> Optional[str]:
         """接收完整的HTTP请求"""
+        # 头部和请求体分别有总时限，防止慢速客户端长期占用连接
+        deadline = Deadline('header_read', self.timeouts.header_read)
         try:
-            client_socket.settimeout(30)  # 30秒超时
             request_data = b""
             
             while True:
+                deadline.apply(client_socket)
                 chunk = client_socket.recv(4096)
                 if not chunk:
                     break
@@ -155,6 +463,9 @@ class HTTPVPNProxy:
                         
                         if body_received >= content_length:
                             break
+                        
+                        if deadline.phase == 'header_read':
+                            deadline = Deadline('body_read', self.timeouts.body_read)
                     else:
                         # 没有Content-Length，认为请求完整
                         break
@@ -162,7 +473,8 @@ class HTTPVPNProxy:
             return request_data.decode('utf-8', errors='ignore')
             
         except socket.timeout:
-            print("接收请求超时")
+            self.timeout_counters.increment(deadline.phase)
+            print(f"接收请求超时 ({deadline.phase})")
             return None
         except Exception as e:
             print(f"接收请求时出错: {e}")
@@ -185,56 +497,108 @@ class HTTPVPNProxy:
 
     
     def forward_to_container(self, client_socket: socket.socket, target_port: int, 
-                           clean_request: str, username: str):
+                           clean_request: str, username: str,
+                           refreshed_token: Optional[str] = None, session_id: Optional[str] = None):
         """转发请求到目标容器"""
+        pool = None
+        replica = None
+        breaker = None
+        target_socket = None
+        upstream_done = False
         try:
-            # 端口到容器名的映射
-            container_mapping = {
-                6060: 'nginx-user-aaa',
-                8080: 'nginx-user-bbb',
-                9090: 'nginx-user-ccc'
-            }
-            
-            container_name = container_mapping.get(target_port)
-            if not container_name:
+            pool = self.upstream_pools.get(target_port)
+            if not pool:
                 print(f"未找到端口 {target_port} 对应的容器")
                 self.send_error_response(client_socket, 500, "Internal Server Error")
                 return
             
+            # 选择副本；所有副本都熔断时快速失败，避免占用线程等待不健康的容器
+            sticky_key = (session_id or username) if self.sticky_sessions else None
+            replica = pool.choose(sticky_key)
+            if not replica:
+                print(f"[熔断] {pool.name} 当前没有可用副本，快速返回503")
+                self.send_error_response(client_socket, 503, "Service Unavailable")
+                return
+            
+            container_name, container_port = replica
+            breaker = self.upstream_breakers[replica]
+            start_time = time.monotonic()
+            
             # 通过容器名连接到目标容器（Docker内部网络）
             target_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            target_socket.connect((container_name, 80))  # 连接容器内部的80端口
-            
-            print(f"[容器连接] {username} → {container_name}:80")
+            target_socket.settimeout(self.timeouts.upstream_connect)
+            try:
+                target_socket.connect(replica)
+            except socket.timeout:
+                self.timeout_counters.increment('upstream_connect')
+                print(f"连接容器 {container_name}:{container_port} 超时")
+                breaker.record_failure("连接超时", time.monotonic() - start_time)
+                self.send_error_response(client_socket, 504, "Gateway Timeout")
+                return
             
-            # 发送清理后的请求
-            target_socket.send(clean_request.encode('utf-8'))
+            print(f"[容器连接] {username} → {container_name}:{container_port}")
             
-            # 接收容器响应
-            response_data = self.receive_response(target_socket)
-            target_socket.close()
+            # 发送请求和接收响应共用一个时限，任一阶段超时都按网关超时处理
+            response_deadline = Deadline('upstream_response', self.timeouts.upstream_response)
+            timing = {}
+            try:
+                # 发送清理后的请求
+                send_with_deadline(target_socket, clean_request.encode('utf-8'), response_deadline)
+                
+                # 接收容器响应
+                response_data = self.receive_response(target_socket, response_deadline, timing)
+            except socket.timeout:
+                self.timeout_counters.increment('upstream_response')
+                print(f"等待容器 {container_name}:{container_port} 响应超时")
+                breaker.record_failure("响应超时", time.monotonic() - start_time)
+                self.send_error_response(client_socket, 504, "Gateway Timeout")
+                return
+            upstream_done = True
             
             if response_data:
+                # 熔断器只看响应头到达的时间：大文件下载等响应体传输较慢的请求不算上游异常
+                headers_at = timing.get('headers_at', time.monotonic())
+                breaker.record_success(headers_at - start_time, delivered=True)
+                
                 # 注入认证机制到响应中
-                modified_response = self.inject_auth_mechanism(response_data, username)
-                client_socket.send(modified_response)
+                modified_response = self.inject_auth_mechanism(response_data, username,
+                                                               refreshed_token, session_id)
+                self.send_to_client(client_socket, modified_response)
             else:
+                breaker.record_failure("未收到容器响应", time.monotonic() - start_time)
                 self.send_error_response(client_socket, 502, "Bad Gateway")
                 
+        except ClientWriteError:
+            # 客户端写失败时响应可能已部分写出，不能再追加错误响应
+            raise
         except ConnectionRefusedError:
-            print(f"无法连接到容器 {container_name}")
+            print(f"无法连接到容器 {replica[0]}:{replica[1]}")
+            breaker.record_failure("连接被拒绝")
             self.send_error_response(client_socket, 503, "Service Unavailable")
         except Exception as e:
             print(f"转发请求时出错: {e}")
+            if breaker and not upstream_done:
+                breaker.record_failure(str(e))
             self.send_error_response(client_socket, 500, "Internal Server Error")
+        finally:
+            if target_socket:
+                target_socket.close()
+            if replica:
+                pool.release(replica)
     
-    def receive_response(self, target_socket: socket.socket) -> Optional[bytes]:
-        """接收目标容器的响应"""
+    def receive_response(self, target_socket: socket.socket,
+                         deadline: Optional[Deadline] = None,
+                         timing: Optional[Dict[str, float]] = None) -> Optional[bytes]:
+        """接收目标容器的响应（超时抛出socket.timeout，由调用方计数并返回504）
+
+        传入timing时，在收到完整响应头的时刻写入 timing['headers_at']（time.monotonic()）。
+        """
+        deadline = deadline or Deadline('upstream_response', self.timeouts.upstream_response)
         try:
-            target_socket.settimeout(30)
             response_data = b""
             
             while True:
+                deadline.apply(target_socket)
                 chunk = target_socket.recv(4096)
                 if not chunk:
                     break
@@ -242,6 +606,8 @@ class HTTPVPNProxy:
                 
                 # 简单的响应完整性检查
                 if b"\r\n\r\n" in response_data:
+                    if timing is not None and 'headers_at' not in timing:
+                        timing['headers_at'] = time.monotonic()
                     headers_end = response_data.find(b"\r\n\r\n")
                     headers_part = response_data[:headers_end].decode('utf-8', errors='ignore')
                     
@@ -263,17 +629,46 @@ class HTTPVPNProxy:
             return response_data
             
         except socket.timeout:
-            print("接收容器响应超时")
-            return None
+            raise
         except Exception as e:
             print(f"接收容器响应时出错: {e}")
             return None
     
-    def inject_auth_mechanism(self, response_data: bytes, username: str) -> bytes:
+    def inject_auth_mechanism(self, response_data: bytes, username: str,
+                              refreshed_token: Optional[str] = None,
+                              session_id: Optional[str] = None) -> bytes:
         """简化的HTTP响应处理 - 基本透明代理"""
         # 简化后只做基本的透明代理，不注入复杂的JavaScript
         # 认证由转发器在请求层面处理，无需在响应中注入代码
-        return response_data
+        if not refreshed_token:
+            return response_data
+        
+        # 无状态模式下通过Set-Cookie下发刷新后的token，实现滑动超时
+        status_end = response_data.find(b"\r\n")
+        if status_end == -1:
+            return response_data
+        
+        max_age = self.auth_manager.session_timeout_minutes * 60
+        attributes = f"Max-Age={max_age}; Path=/; SameSite=Lax" + ("; Secure" if self.tls else "")
+        cookie_headers = f"\r\nSet-Cookie: auth_token={refreshed_token}; {attributes}"
+        if session_id:
+            cookie_headers += f"\r\nSet-Cookie: session_id={session_id}; {attributes}"
+        
+        print(f"[Token刷新] {username}")
+        return response_data[:status_end] + cookie_headers.encode('utf-8') + response_data[status_end:]
+    
+    def send_to_client(self, client_socket: socket.socket, data: bytes):
+        """在客户端写超时内发送完整响应，失败时抛出ClientWriteError"""
+        self.recorder.note_response(data)
+        deadline = Deadline('client_write', self.timeouts.client_write)
+        try:
+            send_with_deadline(client_socket, data, deadline)
+        except socket.timeout as e:
+            self.timeout_counters.increment('client_write')
+            print("向客户端发送响应超时")
+            raise ClientWriteError(str(e)) from e
+        except OSError as e:
+            raise ClientWriteError(str(e)) from e
     
     def send_html_response(self, client_socket: socket.socket, html_content: str):
         """发送HTML响应"""
@@ -286,7 +681,20 @@ class HTTPVPNProxy:
             f"\r\n"
         ).encode('utf-8') + html_bytes
         
-        client_socket.send(response)
+        self.send_to_client(client_socket, response)
+    
+    def send_json_response(self, client_socket: socket.socket, data, code: int = 200, message: str = "OK"):
+        """发送JSON响应"""
+        json_bytes = json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8')
+        response = (
+            f"HTTP/1.1 {code} {message}\r\n"
+            f"Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(json_bytes)}\r\n"
+            f"Connection: close\r\n"
+            f"\r\n"
+        ).encode('utf-8') + json_bytes
+        
+        self.send_to_client(client_socket, response)
     
     def send_unauthorized_response(self, client_socket: socket.socket):
         """发送401未授权响应"""
@@ -321,7 +729,7 @@ class HTTPVPNProxy:
             f"\r\n"
         ).encode('utf-8') + html_bytes
         
-        client_socket.send(response)
+        self.send_to_client(client_socket, response)
     
     def send_redirect_to_login(self, client_socket: socket.socket):
         """重定向到登录页面"""
@@ -332,7 +740,21 @@ class HTTPVPNProxy:
             "Connection: close\r\n"
             "\r\n"
         )
-        client_socket.send(response.encode('utf-8'))
+        self.send_to_client(client_socket, response.encode('utf-8'))
+    
+    def send_too_many_requests_response(self, client_socket: socket.socket, retry_after: float):
+        """发送429请求过多响应"""
+        html_bytes = "<h1>429 Too Many Requests</h1>".encode('utf-8')
+        response = (
+            f"HTTP/1.1 429 Too Many Requests\r\n"
+            f"Content-Type: text/html\r\n"
+            f"Content-Length: {len(html_bytes)}\r\n"
+            f"Retry-After: {max(1, int(retry_after + 0.999))}\r\n"
+            f"Connection: close\r\n"
+            f"\r\n"
+        ).encode('utf-8') + html_bytes
+        
+        self.send_to_client(client_socket, response)
     
     def send_404_response(self, client_socket: socket.socket):
         """发送404响应"""
@@ -344,7 +766,7 @@ class HTTPVPNProxy:
             "\r\n"
             "<h1>404 Not Found</h1>"
         )
-        client_socket.send(response.encode('utf-8'))
+        self.send_to_client(client_socket, response.encode('utf-8'))
     
     def send_error_response(self, client_socket: socket.socket, code: int, message: str):
         """发送错误响应"""
@@ -359,10 +781,21 @@ class HTTPVPNProxy:
             f"\r\n"
         ).encode('utf-8') + html_bytes
         
-        client_socket.send(response)
+        self.send_to_client(client_socket, response)
+    
+    def hot_restart(self):
+        """热重启：新进程接管监听套接字后，当前进程排空并退出"""
+        if not self.running or self.server_socket is None:
+            return
+        
+        print("开始热重启转发器...")
+        successor_pid = spawn_successor(self.server_socket)
+        if successor_pid:
+            self.successor_pid = successor_pid
+            self.stop()
     
     def stop(self):
-        """停止代理服务器"""
+        """停止接受新连接，进行中的请求由start()在退出前排空"""
         self.running = False
 
 if __name__ == "__main__":
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+热重启支持 - 新进程继承旧进程的监听套接字，旧进程排空后退出
+"""
+
+import os
+import select
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+from typing import Dict, Optional
+
+# 通过环境变量把监听套接字和就绪通知管道的文件描述符传给新进程
+LISTEN_FD_ENV = 'DOCKERGATE_LISTEN_FD'
+READY_FD_ENV = 'DOCKERGATE_READY_FD'
+
+# 转发器配置文件（每行 KEY=VALUE），冷启动和每次热重启时重新读取并覆盖环境变量
+ENV_FILE = os.environ.get('PROXY_ENV_FILE', os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'shared', 'proxy.env'))
+
+# 记录上次从配置文件加载的变量名，文件中删除的变量在下次热重启时随之移除
+ENV_FILE_KEYS_ENV = 'DOCKERGATE_ENV_FILE_KEYS'
+
+# 当前负责接受连接的转发器进程ID，PID 1守护进程据此转发信号
+PID_FILE = os.path.join(tempfile.gettempdir(), 'dockergate-proxy.pid')
+
+def load_env_file(path: str) -> Dict[str, str]:
+    """读取 KEY=VALUE 格式的配置文件，忽略空行和#注释，文件不存在时返回空字典"""
+    values = {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#') or '=' not in line:
+                    continue
+                key, _, value = line.partition('=')
+                values[key.strip()] = value.strip().strip('"\'')
+    except FileNotFoundError:
+        pass
+    return values
+
+def apply_env_file(env, path: str = ENV_FILE):
+    """用配置文件的当前内容覆盖env（os.environ或其副本）"""
+    for key in env.pop(ENV_FILE_KEYS_ENV, '').split(','):
+        if key:
+            env.pop(key, None)
+
+    values = load_env_file(path)
+    env.update(values)
+    env[ENV_FILE_KEYS_ENV] = ','.join(values)
+    return env
+
+def inherited_listen_socket() -> Optional[socket.socket]:
+    """获取从旧进程继承的监听套接字，没有则返回None"""
+    listen_fd = os.environ.pop(LISTEN_FD_ENV, None)
+    if not listen_fd:
+        return None
+    return socket.socket(fileno=int(listen_fd))
+
+def notify_ready():
+    """通知旧进程新进程已准备好接受连接，并记录当前进程ID"""
+    with open(PID_FILE, 'w') as f:
+        f.write(str(os.getpid()))
+
+    ready_fd = os.environ.pop(READY_FD_ENV, None)
+    if ready_fd:
+        try:
+            os.write(int(ready_fd), b'1')
+        finally:
+            os.close(int(ready_fd))
+
+def spawn_successor(listen_socket: socket.socket, timeout: float = 30.0) -> Optional[int]:
+    """以相同参数启动新进程并交出监听套接字，新进程就绪后返回其进程ID
+
+    新进程的环境变量会重新读取配置文件，因此热重启可以应用新的配置。
+    """
+    read_fd, write_fd = os.pipe()
+    listen_fd = listen_socket.fileno()
+
+    env = apply_env_file(dict(os.environ))
+    env[LISTEN_FD_ENV] = str(listen_fd)
+    env[READY_FD_ENV] = str(write_fd)
+
+    try:
+        successor = subprocess.Popen([sys.executable] + sys.argv, env=env,
+                                     pass_fds=(listen_fd, write_fd))
+    except OSError as e:
+        print(f"启动新转发器进程失败: {e}")
+        os.close(read_fd)
+        os.close(write_fd)
+        return None
+    os.close(write_fd)
+
+    # 等待新进程就绪，超时或新进程提前退出则放弃本次重启
+    try:
+        readable, _, _ = select.select([read_fd], [], [], timeout)
+        ready = bool(readable) and os.read(read_fd, 1) == b'1'
+    finally:
+        os.close(read_fd)
+
+    if not ready:
+        print("新转发器进程未能就绪，继续由当前进程提供服务")
+        successor.kill()
+        successor.wait()
+        return None
+
+    print(f"新转发器进程已就绪: PID {successor.pid}")
+    return successor.pid
+
+def reap_successors():
+    """作为容器PID 1时，交出服务后继续回收子进程并转发信号，避免容器退出"""
+    def forward_signal(signum, frame):
+        try:
+            with open(PID_FILE, 'r') as f:
+                os.kill(int(f.read().strip()), signum)
+        except (OSError, ValueError) as e:
+            print(f"转发信号失败: {e}")
+
+    for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+        signal.signal(signum, forward_signal)
+
+    # 孤儿进程会被重新挂到PID 1下，全部退出后才结束
+    while True:
+        try:
+            os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
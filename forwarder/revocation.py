@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+令牌撤销集合 - 无状态会话校验模式下记录已撤销的token ID
+"""
+
+import heapq
+import threading
+import time
+from typing import Dict, Optional
+
+class RevocationSet:
+    """已撤销token ID集合
+
+    每个条目记录其失效时间，超过该时间后任何携带此ID的token都已过期，
+    条目即可删除，因此集合大小只与最近一个超时周期内的撤销数量相关。
+    """
+
+    def __init__(self):
+        self.revoked: Dict[str, float] = {}
+        self.expiry_heap = []
+        self.lock = threading.Lock()
+
+    def add(self, jti: str, expires: float):
+        """记录被撤销的token ID及其失效时间（Unix时间戳）"""
+        with self.lock:
+            if expires <= self.revoked.get(jti, 0):
+                return
+            self.revoked[jti] = expires
+            heapq.heappush(self.expiry_heap, (expires, jti))
+            self.prune_locked(time.time())
+
+    def is_revoked(self, jti: str) -> bool:
+        """检查token ID是否已被撤销"""
+        expires = self.revoked.get(jti)
+        return expires is not None and expires > time.time()
+
+    def replace(self, revoked: Dict[str, float]):
+        """用全量数据替换当前集合"""
+        now = time.time()
+        with self.lock:
+            self.revoked = {jti: expires for jti, expires in revoked.items() if expires > now}
+            self.expiry_heap = [(expires, jti) for jti, expires in self.revoked.items()]
+            heapq.heapify(self.expiry_heap)
+
+    def prune(self, now: Optional[float] = None):
+        """删除已经失效的条目"""
+        with self.lock:
+            self.prune_locked(now if now is not None else time.time())
+
+    def prune_locked(self, now: float):
+        """删除已经失效的条目（调用方需持有锁）"""
+        while self.expiry_heap and self.expiry_heap[0][0] <= now:
+            expires, jti = heapq.heappop(self.expiry_heap)
+            # 同一ID可能被更晚的失效时间覆盖，只删除仍匹配的条目
+            if self.revoked.get(jti) == expires:
+                del self.revoked[jti]
+
+    def __len__(self) -> int:
+        return len(self.revoked)
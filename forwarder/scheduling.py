@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+按用户的限流与公平调度 - 防止单个用户占满转发器资源
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, Any, Mapping
+
+class TokenBucket:
+    """令牌桶：平均速率rate（次/秒），最多累积burst个令牌"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    def try_acquire(self) -> bool:
+        """尝试取出一个令牌（调用方需保证线程安全）"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def retry_after(self) -> float:
+        """距离下一个令牌可用的秒数"""
+        return max(0.0, (1 - self.tokens) / self.rate) if self.rate > 0 else 60.0
+
+class UserRateLimiter:
+    """每个用户一个令牌桶"""
+
+    def __init__(self, rate: float = 20.0, burst: float = 40.0):
+        self.rate = rate
+        self.burst = burst
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.rejected: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, environ: Mapping[str, str] = os.environ) -> 'UserRateLimiter':
+        """从环境变量 USER_RATE / USER_BURST 读取配置"""
+        return cls(
+            rate=float(environ.get('USER_RATE', 20.0)),
+            burst=float(environ.get('USER_BURST', 40.0))
+        )
+
+    def allow(self, username: str) -> float:
+        """检查用户请求是否在速率限制内，返回0表示允许，否则返回建议的重试秒数"""
+        with self.lock:
+            bucket = self.buckets.get(username)
+            if bucket is None:
+                bucket = self.buckets[username] = TokenBucket(self.rate, self.burst)
+
+            if bucket.try_acquire():
+                return 0.0
+
+            self.rejected[username] = self.rejected.get(username, 0) + 1
+            return max(bucket.retry_after(), 0.001)
+
+class FairScheduler:
+    """按用户公平分配转发槽位
+
+    全局最多max_active个请求同时转发，单个用户最多per_user_active个；
+    空出的槽位在有等待请求的用户之间轮转分配，每个用户最多排队per_user_queue个请求。
+    """
+
+    def __init__(self, max_active: int = 64, per_user_active: int = 8,
+                 per_user_queue: int = 32, queue_timeout: float = 10.0):
+        self.max_active = max_active
+        self.per_user_active = per_user_active
+        self.per_user_queue = per_user_queue
+        self.queue_timeout = queue_timeout
+
+        self.active_total = 0
+        self.active: Dict[str, int] = {}
+        self.queues: Dict[str, deque] = {}
+        self.round_robin = deque()
+        self.granted = set()
+        self.rejected: Dict[str, int] = {}
+        self.condition = threading.Condition()
+
+    @classmethod
+    def from_env(cls, environ: Mapping[str, str] = os.environ) -> 'FairScheduler':
+        """从环境变量 MAX_ACTIVE_REQUESTS / USER_CONCURRENCY / USER_QUEUE / USER_QUEUE_TIMEOUT 读取配置"""
+        return cls(
+            max_active=int(environ.get('MAX_ACTIVE_REQUESTS', 64)),
+            per_user_active=int(environ.get('USER_CONCURRENCY', 8)),
+            per_user_queue=int(environ.get('USER_QUEUE', 32)),
+            queue_timeout=float(environ.get('USER_QUEUE_TIMEOUT', 10.0))
+        )
+
+    def acquire(self, username: str) -> bool:
+        """为用户申请一个转发槽位，队列已满或等待超时返回False"""
+        with self.condition:
+            queue = self.queues.setdefault(username, deque())
+            if len(queue) >= self.per_user_queue:
+                self.rejected[username] = self.rejected.get(username, 0) + 1
+                return False
+
+            ticket = object()
+            queue.append(ticket)
+            if username not in self.round_robin:
+                self.round_robin.append(username)
+            self.dispatch()
+
+            deadline = time.monotonic() + self.queue_timeout
+            while ticket not in self.granted:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    queue.remove(ticket)
+                    if not queue and username in self.round_robin:
+                        self.round_robin.remove(username)
+                    self.rejected[username] = self.rejected.get(username, 0) + 1
+                    return False
+                self.condition.wait(remaining)
+
+            self.granted.discard(ticket)
+            return True
+
+    def release(self, username: str):
+        """归还用户的转发槽位"""
+        with self.condition:
+            self.active_total -= 1
+            self.active[username] -= 1
+            self.dispatch()
+
+    def dispatch(self):
+        """按轮转顺序把空闲槽位分配给等待中的用户（调用方需持有锁）"""
+        granted_any = False
+        skipped = 0
+
+        while self.round_robin and self.active_total < self.max_active and skipped < len(self.round_robin):
+            username = self.round_robin.popleft()
+            queue = self.queues[username]
+
+            if self.active.get(username, 0) >= self.per_user_active:
+                # 该用户已达到并发上限，让给下一个用户
+                self.round_robin.append(username)
+                skipped += 1
+                continue
+
+            self.granted.add(queue.popleft())
+            self.active[username] = self.active.get(username, 0) + 1
+            self.active_total += 1
+            granted_any = True
+            skipped = 0
+
+            if queue:
+                self.round_robin.append(username)
+
+        if granted_any:
+            self.condition.notify_all()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """返回调度状态快照"""
+        with self.condition:
+            users = set(self.active) | set(self.queues) | set(self.rejected)
+            return {
+                'active_total': self.active_total,
+                'max_active': self.max_active,
+                'users': {
+                    username: {
+                        'active': self.active.get(username, 0),
+                        'queued': len(self.queues.get(username, ())),
+                        'rejected': self.rejected.get(username, 0)
+                    }
+                    for username in sorted(users)
+                }
+            }
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+会话事件通道 - 接收认证服务器推送的会话创建/撤销事件
+"""
+
+import json
+import os
+import socket
+import threading
+import time
+
+class SessionEventListener:
+    """会话事件监听器
+
+    每个转发器进程在共享目录下绑定一个独立的Unix数据报套接字，
+    认证服务器向目录中所有套接字广播事件，由AuthManager应用到内存会话。
+    """
+
+    def __init__(self, auth_manager, event_dir: str, flush_interval: float = 1.0):
+        self.auth_manager = auth_manager
+        self.event_dir = event_dir
+        self.flush_interval = flush_interval
+        self.socket_path = os.path.join(event_dir, f"proxy-{os.getpid()}.sock")
+        self.running = False
+        self.sock = None
+        self.thread = None
+        self.flush_thread = None
+
+    def start(self) -> bool:
+        """绑定事件套接字并启动监听线程，失败时返回False"""
+        if not hasattr(socket, 'AF_UNIX'):
+            print("当前平台不支持Unix套接字，会话事件通道未启用")
+            return False
+
+        try:
+            os.makedirs(self.event_dir, exist_ok=True)
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self.sock.bind(self.socket_path)
+            self.sock.settimeout(1.0)
+        except OSError as e:
+            print(f"会话事件通道启动失败: {e}")
+            self.sock = None
+            return False
+
+        # 先绑定套接字再全量同步，避免漏掉两者之间的事件
+        self.auth_manager.enable_session_cache()
+
+        self.running = True
+        self.thread = threading.Thread(target=self.listen, daemon=True)
+        self.thread.start()
+        self.flush_thread = threading.Thread(target=self.flush_activity, daemon=True)
+        self.flush_thread.start()
+
+        print(f"会话事件通道: {self.socket_path}")
+        return True
+
+    def listen(self):
+        """接收并应用会话事件"""
+        while self.running:
+            try:
+                data = self.sock.recv(65536)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+
+            try:
+                event = json.loads(data.decode('utf-8'))
+            except (UnicodeDecodeError, json.JSONDecodeError):
+                print("收到无法解析的会话事件，执行全量重同步")
+                self.auth_manager.resync_sessions()
+                continue
+
+            self.auth_manager.apply_session_event(event)
+
+    def flush_activity(self):
+        """有活动更新时回写会话文件，两次回写至少间隔flush_interval秒"""
+        last_flush = 0.0
+
+        while self.running:
+            if not self.auth_manager.activity_pending.wait(1.0):
+                continue
+
+            delay = last_flush + self.flush_interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+            self.auth_manager.activity_pending.clear()
+            self.auth_manager.flush_session_activity()
+            last_flush = time.monotonic()
+
+    def stop(self):
+        """停止监听并移除套接字文件"""
+        self.running = False
+
+        if self.sock:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+
+        try:
+            os.unlink(self.socket_path)
+        except OSError:
+            pass
+
+        self.auth_manager.flush_session_activity()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+TLS终结 - 在转发器内直接提供HTTPS，支持会话恢复和证书热加载
+"""
+
+import os
+import socket
+import ssl
+import tempfile
+import threading
+import time
+from typing import Dict, Any, Optional
+
+class TLSTerminator:
+    """转发器的TLS终结器
+
+    整个进程只使用一个SSLContext：OpenSSL的服务端会话缓存和会话票据密钥
+    都保存在其中，客户端重连时可以跳过完整握手。证书文件变化时在同一个
+    SSLContext上重新加载证书，已签发的会话票据依然有效。
+    """
+
+    def __init__(self, cert_file: str, key_file: str,
+                 handshake_timeout: float = 10.0, reload_interval: float = 5.0):
+        self.cert_file = cert_file
+        self.key_file = key_file
+        self.handshake_timeout = handshake_timeout
+        self.reload_interval = reload_interval
+
+        self.context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        self.context.minimum_version = ssl.TLSVersion.TLSv1_2
+        self.context.load_cert_chain(cert_file, key_file)
+        self.cert_signature = self.file_signature()
+        self.pending_signature = None
+        self.last_reload_check = time.monotonic()
+
+        self.stats = {
+            'handshakes': 0,
+            'resumed': 0,
+            'failures': 0,
+            'timeouts': 0,
+            'total_handshake_ms': 0.0,
+            'max_handshake_ms': 0.0,
+            'reloads': 0
+        }
+        self.lock = threading.Lock()
+
+    def file_signature(self):
+        """证书和私钥文件的修改时间，用于发现证书更新"""
+        return tuple(os.stat(path).st_mtime_ns for path in (self.cert_file, self.key_file))
+
+    def maybe_reload(self):
+        """距离上次检查超过reload_interval时检查证书文件，有变化则重新加载
+
+        证书和私钥通常不会同时被替换：文件变化后要等到下一次检查时仍未再变化
+        才加载，并且先在临时SSLContext中校验证书与私钥匹配，通过后再加载到
+        正在使用的SSLContext。load_cert_chain失败时会破坏所在的SSLContext，
+        所以不能直接在正在使用的SSLContext上试错。
+        """
+        now = time.monotonic()
+        if now - self.last_reload_check < self.reload_interval:
+            return
+        self.last_reload_check = now
+
+        try:
+            signature = self.file_signature()
+        except OSError as e:
+            print(f"[TLS] 检查证书文件失败: {e}")
+            return
+
+        if signature == self.cert_signature:
+            self.pending_signature = None
+            return
+        if signature != self.pending_signature:
+            # 文件刚发生变化，等下一次检查确认已写完
+            self.pending_signature = signature
+            return
+
+        try:
+            self.load_verified()
+        except (OSError, ssl.SSLError) as e:
+            # 新证书与私钥不匹配或无法解析，继续使用旧证书，文件再次变化后重试
+            print(f"[TLS] 新证书校验失败，继续使用旧证书: {e}")
+            self.cert_signature = signature
+            self.pending_signature = None
+            return
+
+        self.cert_signature = signature
+        self.pending_signature = None
+        with self.lock:
+            self.stats['reloads'] += 1
+        print(f"[TLS] 证书已重新加载: {self.cert_file}")
+
+    def load_verified(self):
+        """把证书和私钥复制为快照，在临时SSLContext中校验通过后再加载到正在使用的SSLContext"""
+        with tempfile.TemporaryDirectory() as snapshot_dir:
+            snapshot = []
+            for path in (self.cert_file, self.key_file):
+                snapshot_path = os.path.join(snapshot_dir, os.path.basename(path) or 'pem')
+                if snapshot and snapshot_path == snapshot[0]:
+                    snapshot_path += '.key'
+                with open(path, 'rb') as source, open(snapshot_path, 'wb') as target:
+                    target.write(source.read())
+                snapshot.append(snapshot_path)
+
+            trial_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            trial_context.load_cert_chain(*snapshot)
+            self.context.load_cert_chain(*snapshot)
+
+    def wrap(self, client_socket: socket.socket) -> Optional[ssl.SSLSocket]:
+        """完成服务端握手，失败时关闭连接并返回None"""
+        start_time = time.monotonic()
+        try:
+            client_socket.settimeout(self.handshake_timeout)
+            tls_socket = self.context.wrap_socket(client_socket, server_side=True,
+                                                  do_handshake_on_connect=False)
+            tls_socket.do_handshake()
+        except socket.timeout:
+            self.record_failure('timeouts')
+            client_socket.close()
+            return None
+        except (OSError, ssl.SSLError) as e:
+            self.record_failure('failures')
+            print(f"[TLS] 握手失败: {e}")
+            client_socket.close()
+            return None
+
+        elapsed_ms = (time.monotonic() - start_time) * 1000
+        with self.lock:
+            self.stats['handshakes'] += 1
+            if tls_socket.session_reused:
+                self.stats['resumed'] += 1
+            self.stats['total_handshake_ms'] += elapsed_ms
+            self.stats['max_handshake_ms'] = max(self.stats['max_handshake_ms'], elapsed_ms)
+        return tls_socket
+
+    def record_failure(self, kind: str):
+        """记录握手失败或超时"""
+        with self.lock:
+            self.stats[kind] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        """返回握手统计和OpenSSL会话缓存统计"""
+        with self.lock:
+            stats = dict(self.stats)
+
+        handshakes = stats['handshakes']
+        stats['avg_handshake_ms'] = round(stats['total_handshake_ms'] / handshakes, 2) if handshakes else None
+        stats['resumption_rate'] = round(stats['resumed'] / handshakes, 3) if handshakes else None
+        stats['total_handshake_ms'] = round(stats['total_handshake_ms'], 2)
+        stats['max_handshake_ms'] = round(stats['max_handshake_ms'], 2)
+        stats['session_cache'] = self.context.session_stats()
+        return stats
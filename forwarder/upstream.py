@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+上游容器健康检查、熔断器与多副本负载均衡
+"""
+
+import random
+import socket
+import threading
+import time
+import zlib
+from typing import Dict, Any, List, Optional, Tuple
+
+class CircuitBreaker:
+    """单个上游容器的熔断器
+
+    连续失败（或响应过慢）达到阈值后进入open状态，直接拒绝请求；
+    冷却时间结束后进入half_open状态，只放行一个试探请求，成功则恢复。
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name: str, failure_threshold: int = 5,
+                 latency_threshold: float = 5.0, open_seconds: float = 10.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.latency_threshold = latency_threshold
+        self.open_seconds = open_seconds
+
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.last_latency: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.total_successes = 0
+        self.total_failures = 0
+        self.rejected = 0
+        self.slow_responses = 0
+        self.lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        """判断当前是否允许向该上游发送请求"""
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.open_seconds:
+                    self.rejected += 1
+                    return False
+                self.state = self.HALF_OPEN
+                self.trial_in_flight = False
+                print(f"[熔断器] {self.name} 进入半开状态，开始试探")
+
+            # 半开状态同一时间只放行一个试探请求
+            if self.trial_in_flight:
+                self.rejected += 1
+                return False
+            self.trial_in_flight = True
+            return True
+
+    def record_success(self, latency: float, delivered: bool = False):
+        """记录一次成功请求
+
+        健康检查的响应过慢按失败处理；delivered=True表示真实请求的响应已完整交付，
+        不论多慢都不计为失败，只计入慢响应统计。
+        """
+        if latency > self.latency_threshold:
+            if not delivered:
+                self.record_failure(f"响应过慢 ({latency:.2f}s)", latency)
+                return
+            with self.lock:
+                self.slow_responses += 1
+
+        with self.lock:
+            self.last_latency = latency
+            self.total_successes += 1
+            self.consecutive_failures = 0
+            self.trial_in_flight = False
+            if self.state != self.CLOSED:
+                print(f"[熔断器] {self.name} 恢复正常")
+                self.state = self.CLOSED
+
+    def record_failure(self, error: str, latency: Optional[float] = None):
+        """记录一次失败请求"""
+        with self.lock:
+            self.last_error = error
+            if latency is not None:
+                self.last_latency = latency
+            self.total_failures += 1
+            self.consecutive_failures += 1
+            self.trial_in_flight = False
+
+            if (self.state == self.HALF_OPEN or
+                (self.state == self.CLOSED and self.consecutive_failures >= self.failure_threshold)):
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                print(f"[熔断器] {self.name} 已熔断: {error} (连续失败 {self.consecutive_failures} 次)")
+
+    def snapshot(self) -> Dict[str, Any]:
+        """返回熔断器状态快照"""
+        with self.lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self.consecutive_failures,
+                'last_latency_ms': round(self.last_latency * 1000, 1) if self.last_latency is not None else None,
+                'last_error': self.last_error,
+                'total_successes': self.total_successes,
+                'total_failures': self.total_failures,
+                'rejected': self.rejected,
+                'slow_responses': self.slow_responses
+            }
+
+class UpstreamHealthChecker:
+    """上游容器主动健康检查
+
+    定期向每个上游发送HEAD请求，结果计入对应的熔断器；
+    处于open状态的上游只在冷却结束后才会被探测（即半开试探）。
+    """
+
+    def __init__(self, breakers: Dict[Tuple[str, int], CircuitBreaker],
+                 interval: float = 5.0, timeout: float = 2.0):
+        self.breakers = breakers
+        self.interval = interval
+        self.timeout = timeout
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        """启动健康检查线程"""
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """停止健康检查"""
+        self.running = False
+
+    def run(self):
+        """健康检查主循环"""
+        while self.running:
+            for address, breaker in list(self.breakers.items()):
+                if not self.running:
+                    break
+                if breaker.allow_request():
+                    self.probe(address, breaker)
+            time.sleep(self.interval)
+
+    def probe(self, address: Tuple[str, int], breaker: CircuitBreaker):
+        """探测单个上游，HTTP状态码小于500即视为健康"""
+        start_time = time.monotonic()
+        try:
+            with socket.create_connection(address, timeout=self.timeout) as probe_socket:
+                probe_socket.settimeout(self.timeout)
+                probe_socket.sendall(f"HEAD / HTTP/1.0\r\nHost: {address[0]}\r\n\r\n".encode('utf-8'))
+                status_line = probe_socket.recv(1024).split(b"\r\n", 1)[0].decode('utf-8', errors='ignore')
+        except OSError as e:
+            breaker.record_failure(f"健康检查失败: {e}")
+            return
+
+        parts = status_line.split(' ')
+        if len(parts) >= 2 and parts[1].isdigit() and int(parts[1]) < 500:
+            breaker.record_success(time.monotonic() - start_time)
+        else:
+            breaker.record_failure(f"健康检查响应异常: {status_line[:50]}")
+
+class UpstreamPool:
+    """一个用户路由下的多个上游副本
+
+    默认使用"二选一"(power of two choices)按进行中请求数选择副本；
+    提供粘性键时使用rendezvous哈希，副本增减时只有少量会话被迁移。
+    熔断中的副本自动从候选中移除，全部熔断时才尝试半开试探。
+    """
+
+    def __init__(self, name: str, replicas: List[Tuple[str, int]],
+                 breakers: Dict[Tuple[str, int], CircuitBreaker]):
+        self.name = name
+        self.replicas = replicas
+        self.breakers = breakers
+        self.outstanding: Dict[Tuple[str, int], int] = {replica: 0 for replica in replicas}
+        self.lock = threading.Lock()
+
+    def choose(self, sticky_key: Optional[str] = None) -> Optional[Tuple[str, int]]:
+        """选择一个副本并计入进行中请求，没有可用副本时返回None"""
+        healthy = [replica for replica in self.replicas
+                   if self.breakers[replica].state == CircuitBreaker.CLOSED]
+
+        # 按优先顺序排列候选：首选副本的熔断器可能恰好刚刚打开，此时依次尝试其余健康副本
+        if sticky_key:
+            candidates = sorted(healthy, reverse=True,
+                                key=lambda r: zlib.crc32(f"{sticky_key}|{r[0]}:{r[1]}".encode('utf-8')))
+        elif len(healthy) > 1:
+            first, second = random.sample(healthy, 2)
+            if self.outstanding[second] < self.outstanding[first]:
+                first, second = second, first
+            candidates = [first, second] + [r for r in healthy if r not in (first, second)]
+        else:
+            candidates = healthy
+
+        replica = next((r for r in candidates if self.breakers[r].allow_request()), None)
+        if replica is None:
+            # 所有副本都已熔断，按顺序尝试冷却结束的副本（半开试探）
+            replica = next((r for r in self.replicas
+                            if r not in candidates and self.breakers[r].allow_request()), None)
+            if replica is None:
+                return None
+
+        with self.lock:
+            self.outstanding[replica] += 1
+        return replica
+
+    def release(self, replica: Tuple[str, int]):
+        """请求结束，减少该副本的进行中请求数"""
+        with self.lock:
+            self.outstanding[replica] -= 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        """返回各副本状态快照"""
+        with self.lock:
+            outstanding = dict(self.outstanding)
+        return {
+            f"{host}:{port}": dict(self.breakers[(host, port)].snapshot(), outstanding=outstanding[(host, port)])
+            for host, port in self.replicas
+        }
+
+def parse_upstream_routes(spec: str) -> Dict[int, List[Tuple[str, int]]]:
+    """解析路由配置，如 "6060=nginx-user-aaa:80,nginx-user-aaa-2:80;8080=nginx-user-bbb:80"
+    """
+    routes = {}
+    for route in filter(None, (part.strip() for part in spec.split(';'))):
+        target_port, replicas = route.split('=', 1)
+        routes[int(target_port)] = [
+            (host, int(port)) for host, port in
+            (replica.strip().rsplit(':', 1) for replica in replicas.split(',') if replica.strip())
+        ]
+    return routes
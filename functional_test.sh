@@ -426,6 +426,81 @@ test_response_performance() {
     return 0
 }
 
+# 从JSON响应中读取字段（点号分隔路径，如 by_user.aaa）；字段为对象时输出其键的数量
+json_field() {
+    python3 -c "
+import json, sys
+data = json.load(sys.stdin)
+for key in sys.argv[1].split('.'):
+    data = data.get(key) if isinstance(data, dict) else None
+print(len(data) if isinstance(data, dict) else ('' if data is None else data))
+" "$1" 2>/dev/null
+}
+
+# 测试会话查询API（汇总与分页）
+test_session_api() {
+    print_user_info "测试会话查询API..."
+    
+    # 汇总：登录测试后每个用户恰好保留一个会话（单用户登录）
+    SUMMARY=$(curl -s http://localhost:3001/api/sessions/summary)
+    TOTAL_ACTIVE=$(echo "$SUMMARY" | json_field total_active)
+    USER_COUNT=$(echo "$SUMMARY" | json_field by_user)
+    
+    if [ -z "$TOTAL_ACTIVE" ]; then
+        print_failure "会话汇总API无法访问或返回格式错误"
+        return 1
+    fi
+    print_info "活跃会话总数: $TOTAL_ACTIVE (用户数: $USER_COUNT)"
+    
+    for user in $USERS_LIST; do
+        if [ "$(echo "$SUMMARY" | json_field "by_user.$user")" != "1" ]; then
+            print_failure "会话汇总中用户 $user 的会话数不正确"
+            return 1
+        fi
+    done
+    print_success "会话汇总API返回每个用户的活跃会话数"
+    
+    # 按用户过滤分页
+    PAGE=$(curl -s "http://localhost:3001/api/get_user_sessions?username=aaa&offset=0&limit=1")
+    if [ "$(echo "$PAGE" | json_field total_count)" = "1" ] && \
+       [ "$(echo "$PAGE" | json_field active_sessions)" = "1" ] && \
+       [ "$(echo "$PAGE" | json_field username)" = "aaa" ] && \
+       [ "$(echo "$PAGE" | json_field limit)" = "1" ]; then
+        print_success "按用户过滤的会话查询正确 (username/offset/limit)"
+    else
+        print_failure "按用户过滤的会话查询结果不正确"
+        return 1
+    fi
+    
+    # 逐页遍历全部会话：总数与汇总一致，各页不重复，越过末尾返回空页
+    SEEN_SESSIONS=""
+    for offset in $(seq 0 $((TOTAL_ACTIVE - 1))); do
+        PAGE=$(curl -s "http://localhost:3001/api/get_user_sessions?offset=$offset&limit=1")
+        if [ "$(echo "$PAGE" | json_field total_count)" != "$TOTAL_ACTIVE" ] || \
+           [ "$(echo "$PAGE" | json_field active_sessions)" != "1" ]; then
+            print_failure "分页查询第 $offset 条的结果不正确"
+            return 1
+        fi
+        SEEN_SESSIONS="$SEEN_SESSIONS $(echo "$PAGE" | grep -o '"session_[^"]*"' | head -1)"
+    done
+    
+    UNIQUE_SESSIONS=$(echo "$SEEN_SESSIONS" | tr ' ' '\n' | grep -v '^$' | sort -u | wc -l)
+    if [ "$UNIQUE_SESSIONS" -ne "$TOTAL_ACTIVE" ]; then
+        print_failure "分页查询存在重复或遗漏的会话 ($UNIQUE_SESSIONS/$TOTAL_ACTIVE)"
+        return 1
+    fi
+    
+    PAGE=$(curl -s "http://localhost:3001/api/get_user_sessions?offset=$TOTAL_ACTIVE&limit=1")
+    if [ "$(echo "$PAGE" | json_field active_sessions)" = "0" ]; then
+        print_success "分页查询覆盖全部 $TOTAL_ACTIVE 个会话且不重复"
+    else
+        print_failure "越过末尾的分页查询未返回空页"
+        return 1
+    fi
+    
+    return 0
+}
+
 # 主测试流程
 main() {
     echo -e "${CYAN}🏃 开始HTTP VPN系统功能测试...${NC}"
@@ -484,6 +559,12 @@ main() {
         print_failure "性能测试失败"
     fi
     
+    # 9. 测试会话查询API
+    print_test_header "9" "会话查询API测试"
+    if ! test_session_api; then
+        print_failure "会话查询API测试失败"
+    fi
+    
     # 清理临时文件
     print_info "清理测试文件..."
     rm -f cookies_*.txt login_response_*.html container_response_*.html 2>/dev/null
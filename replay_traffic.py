@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""
+流量回放工具 - 按采集文件的时间线重放请求，用于以真实流量形态验证转发器性能
+
+用法:
+  python replay_traffic.py shared/captures/capture-xxx.jsonl            # 启动内置转发器和替身容器，按原速回放
+  python replay_traffic.py capture.jsonl --speed 5                       # 5倍速回放
+  python replay_traffic.py capture.jsonl --target 127.0.0.1:5001         # 回放到外部转发器
+  python replay_traffic.py capture.jsonl --speed 10 --no-limits          # 关闭按用户限流，测量转发本身的性能
+
+内置转发器的限流配置默认读取 USER_RATE / USER_BURST 等环境变量，与正式部署一致；
+加速回放时每个用户的请求速率会同比放大，需用 --user-rate / --user-burst 调整或用
+--no-limits 关闭，否则测到的主要是限流的效果。
+
+回放到外部转发器时，该转发器需以 STATELESS_SESSIONS=1 启动，并把 UPSTREAM_ROUTES
+指向本工具启动的替身容器（启动时会打印对应的配置）；其签名密钥不是默认值时用 --secret-key 指定。
+"""
+
+import argparse
+import contextlib
+import http.server
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import jwt
+
+from forwarder.proxy import HTTPVPNProxy, SECRET_KEY
+from forwarder.scheduling import UserRateLimiter, FairScheduler
+
+# 替身容器从该请求头读取需要返回的响应体大小
+RESPONSE_SIZE_HEADER = 'X-Replay-Response-Size'
+
+# 估算的响应头大小，用于从采集的响应总字节数推算响应体大小
+RESPONSE_HEADER_ESTIMATE = 150
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    """替身容器：按请求头指定的大小返回响应体"""
+
+    def handle_request(self):
+        content_length = int(self.headers.get('Content-Length', 0))
+        if content_length:
+            self.rfile.read(content_length)
+
+        body = b'x' * int(self.headers.get(RESPONSE_SIZE_HEADER, 1024))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    do_GET = do_POST = do_PUT = do_DELETE = do_PATCH = do_OPTIONS = do_HEAD = handle_request
+
+    def log_message(self, format, *args):
+        pass
+
+def load_records(capture_file):
+    """读取采集文件，跳过损坏的行，按时间排序"""
+    records = []
+    with open(capture_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if 'ts' in record and 'm' in record:
+                records.append(record)
+    records.sort(key=lambda record: record['ts'])
+    return records
+
+def start_stand_ins(count):
+    """启动替身容器，返回 [(host, port), ...]"""
+    addresses = []
+    for _ in range(count):
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        addresses.append(server.server_address)
+    return addresses
+
+def mint_token(secret_key, bucket, target_port):
+    """为用户分桶签发一个新会话的token"""
+    session_id = uuid.uuid4().hex
+    payload = {
+        'username': f"replay-user-{bucket}",
+        'target_port': target_port,
+        'exp': datetime.utcnow() + timedelta(days=1),
+        'iat': datetime.utcnow(),
+        'jti': uuid.uuid4().hex,
+        'sid': f"replay_session_{bucket}_{session_id}"
+    }
+    return jwt.encode(payload, secret_key, algorithm='HS256')
+
+def assign_tokens(records, secret_key, route_ports):
+    """按时间顺序为每条记录分配token
+
+    分桶轮流分配到各路由；记录标记为会话首个请求(f=1)时为该分桶签发新会话的token，
+    之后该分桶的请求都使用新token，以还原登录突发时大量新会话同时出现的情况。
+    """
+    routes = {}
+    current = {}
+    tokens = []
+    for record in records:
+        bucket = record.get('u')
+        if bucket is None:
+            tokens.append(None)
+            continue
+        if bucket not in routes:
+            routes[bucket] = route_ports[len(routes) % len(route_ports)]
+        if bucket not in current or record.get('f'):
+            current[bucket] = mint_token(secret_key, bucket, routes[bucket])
+        tokens.append(current[bucket])
+    return tokens
+
+def build_request(record, token):
+    """按采集的大小还原请求"""
+    body = b'x' * record.get('bs', 0)
+    lines = [f"{record['m']} {record['p']} HTTP/1.1", "Host: replay"]
+
+    # 认证失败的请求不带token重放；其余请求把Cookie填充到采集时的大小
+    cookie = f"auth_token={token}" if token and record.get('st') != 401 else ""
+    padding = record.get('ck', 0) - len(cookie) - 2
+    if padding > 0:
+        cookie = f"{cookie}; pad={'p' * max(1, padding - 4)}" if cookie else f"pad={'p' * padding}"
+    if cookie:
+        lines.append(f"Cookie: {cookie}")
+
+    lines.append(f"{RESPONSE_SIZE_HEADER}: {max(0, record.get('rs', 0) - RESPONSE_HEADER_ESTIMATE)}")
+    if body:
+        lines.append(f"Content-Length: {len(body)}")
+    lines.append("Connection: close")
+
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('utf-8') + body
+
+def send_request(target, request, timeout):
+    """发送一个请求，返回 (状态码, 响应字节数, 耗时秒)"""
+    start_time = time.monotonic()
+    try:
+        with socket.create_connection(target, timeout=timeout) as sock:
+            sock.sendall(request)
+            response = b""
+            while True:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                response += chunk
+    except OSError:
+        return 0, 0, time.monotonic() - start_time
+
+    status_line = response[:response.find(b"\r\n")].decode('utf-8', errors='ignore').split(' ')
+    status = int(status_line[1]) if len(status_line) >= 2 and status_line[1].isdigit() else 0
+    return status, len(response), time.monotonic() - start_time
+
+def percentile(values, fraction):
+    """简单百分位数"""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def replay(records, target, tokens, speed, concurrency, timeout):
+    """按时间线回放（tokens与records一一对应），返回每个请求的结果和调度延迟"""
+    results = []
+    lags = []
+    lock = threading.Lock()
+
+    def run(record, request):
+        status, size, elapsed = send_request(target, request, timeout)
+        with lock:
+            results.append((record, status, size, elapsed))
+
+    # 先构造全部请求，签发token等开销不计入回放时间线
+    requests = [build_request(record, token) for record, token in zip(records, tokens)]
+
+    first_ts = records[0]['ts']
+    start_time = time.monotonic()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for record, request in zip(records, requests):
+            due = start_time + (record['ts'] - first_ts) / speed
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            lags.append(max(0.0, -delay))
+            executor.submit(run, record, request)
+
+    return results, lags, time.monotonic() - start_time
+
+def print_summary(records, results, lags, elapsed):
+    """输出回放结果与采集时的对比"""
+    latencies = [result[3] * 1000 for result in results if result[1]]
+    recorded = [record['d'] for record in records if 'd' in record]
+
+    status_counts = {}
+    mismatches = 0
+    for record, status, _, _ in results:
+        status_counts[status] = status_counts.get(status, 0) + 1
+        if 'st' in record and record['st'] != status:
+            mismatches += 1
+
+    def fmt(value):
+        return f"{value:.1f}" if value is not None else "-"
+
+    print("=" * 60)
+    print("流量回放结果")
+    print("=" * 60)
+    print(f"请求数: {len(results)}  用时: {elapsed:.1f}秒  实际速率: {len(results) / elapsed:.1f} 请求/秒")
+    print(f"状态码分布: {dict(sorted(status_counts.items()))}  (0表示连接失败)")
+    print(f"与采集时状态码不一致: {mismatches}")
+    print(f"调度延迟 p99: {fmt(percentile(lags, 0.99) * 1000 if lags else None)} 毫秒")
+    print("")
+    print(f"{'耗时(毫秒)':<12}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}")
+    for label, values in (("回放", latencies), ("采集", recorded)):
+        print(f"{label:<12}{fmt(percentile(values, 0.5)):>10}{fmt(percentile(values, 0.9)):>10}"
+              f"{fmt(percentile(values, 0.99)):>10}{fmt(max(values) if values else None):>10}")
+    print("=" * 60)
+
+def build_limits(args):
+    """按命令行参数构造内置转发器的限流器和调度器，未指定的项读取环境变量"""
+    if args.no_limits:
+        # 所有回放请求都来自本机，并发上限放宽到回放并发数，令牌桶放宽到不会耗尽
+        rate_limiter = UserRateLimiter(rate=1e9, burst=1e9)
+        scheduler = FairScheduler(max_active=args.concurrency, per_user_active=args.concurrency,
+                                  per_user_queue=args.concurrency)
+        return rate_limiter, scheduler
+
+    rate_limiter = UserRateLimiter.from_env()
+    if args.user_rate is not None:
+        rate_limiter.rate = args.user_rate
+    if args.user_burst is not None:
+        rate_limiter.burst = args.user_burst
+    return rate_limiter, FairScheduler.from_env()
+
+def main():
+    parser = argparse.ArgumentParser(description="按采集文件回放流量，验证转发器性能")
+    parser.add_argument('capture_file', help="转发器采集的流量文件 (.jsonl)")
+    parser.add_argument('--speed', type=float, default=1.0, help="回放倍速，默认1倍")
+    parser.add_argument('--target', help="外部转发器地址 host:port，默认启动内置转发器")
+    parser.add_argument('--port', type=int, default=5101, help="内置转发器监听端口")
+    parser.add_argument('--routes', type=int, default=3, help="替身容器（用户路由）数量")
+    parser.add_argument('--concurrency', type=int, default=200, help="最大并发请求数")
+    parser.add_argument('--timeout', type=float, default=60.0, help="单个请求超时秒数")
+    parser.add_argument('--user-rate', type=float, help="内置转发器每个用户的平均请求速率（次/秒），默认读取 USER_RATE")
+    parser.add_argument('--user-burst', type=float, help="内置转发器每个用户的突发请求数，默认读取 USER_BURST")
+    parser.add_argument('--no-limits', action='store_true', help="关闭内置转发器的按用户限流和公平调度限制")
+    parser.add_argument('--secret-key', default=SECRET_KEY, help="签发回放token使用的密钥，需与目标转发器一致")
+    parser.add_argument('--verbose', action='store_true', help="显示内置转发器日志")
+    args = parser.parse_args()
+
+    records = load_records(args.capture_file)
+    if not records:
+        print(f"采集文件中没有可回放的记录: {args.capture_file}")
+        return
+
+    stand_ins = start_stand_ins(args.routes)
+    route_ports = [7000 + i for i in range(len(stand_ins))]
+    routes_spec = ';'.join(f"{port}={host}:{stand_in_port}"
+                           for port, (host, stand_in_port) in zip(route_ports, stand_ins))
+    print(f"替身容器路由: UPSTREAM_ROUTES=\"{routes_spec}\"")
+
+    output = open(os.devnull, 'w') if not args.verbose else None
+    with contextlib.redirect_stdout(output) if output else contextlib.nullcontext():
+        if args.target:
+            host, port = args.target.rsplit(':', 1)
+            target = (host, int(port))
+        else:
+            # 回放用的转发器使用独立的临时目录，不接触真实转发器的会话文件、事件通道和PID文件
+            shared_dir = tempfile.mkdtemp(prefix='dockergate-replay-')
+            rate_limiter, scheduler = build_limits(args)
+            proxy = HTTPVPNProxy(
+                listen_port=args.port,
+                stateless_sessions=True,
+                rate_limiter=rate_limiter,
+                scheduler=scheduler,
+                # 回放请求都来自本机，连接上限不能低于回放并发数
+                max_connections=max(256, args.concurrency),
+                max_connections_per_ip=args.concurrency,
+                upstream_routes={port: [address] for port, address in zip(route_ports, stand_ins)},
+                shared_dir=shared_dir,
+                embedded=True
+            )
+            proxy_thread = threading.Thread(target=proxy.start, daemon=True)
+            proxy_thread.start()
+            target = ('127.0.0.1', args.port)
+            time.sleep(1.0)
+
+        tokens = assign_tokens(records, args.secret_key, route_ports)
+        results, lags, elapsed = replay(records, target, tokens, args.speed, args.concurrency, args.timeout)
+
+        if not args.target:
+            proxy.stop()
+            proxy_thread.join(proxy.drain_timeout + 2)
+            shutil.rmtree(shared_dir, ignore_errors=True)
+
+    print_summary(records, results, lags, elapsed)
+
+if __name__ == "__main__":
+    main()
@@ -3,13 +3,73 @@
 HTTP VPN 转发器启动脚本
 """
 
+import os
+import signal
+
+from forwarder.deadlines import PhaseTimeouts
 from forwarder.proxy import HTTPVPNProxy
+from forwarder.restart import apply_env_file, reap_successors
+from forwarder.tls import TLSTerminator
+from forwarder.scheduling import UserRateLimiter, FairScheduler
+from forwarder.upstream import parse_upstream_routes
 
 if __name__ == "__main__":
-    proxy = HTTPVPNProxy(listen_port=5001)
+    # 配置文件 shared/proxy.env（PROXY_ENV_FILE）中的变量覆盖容器环境变量，热重启时重新读取
+    apply_env_file(os.environ)
+    
+    # 多副本路由，如 UPSTREAM_ROUTES="6060=nginx-user-aaa:80,nginx-user-aaa-2:80;8080=nginx-user-bbb:80"
+    upstream_routes = os.environ.get('UPSTREAM_ROUTES')
+    
+    # 同时设置证书和私钥时启用TLS终结
+    tls = None
+    if os.environ.get('TLS_CERT_FILE') and os.environ.get('TLS_KEY_FILE'):
+        tls = TLSTerminator(os.environ['TLS_CERT_FILE'], os.environ['TLS_KEY_FILE'])
+    
+    proxy = HTTPVPNProxy(
+        listen_port=5001,
+        stateless_sessions=os.environ.get('STATELESS_SESSIONS') == '1',
+        admin_allow=tuple(os.environ.get('ADMIN_ALLOW', '127.0.0.1,::1').split(',')),
+        timeouts=PhaseTimeouts.from_env(),
+        rate_limiter=UserRateLimiter.from_env(),
+        scheduler=FairScheduler.from_env(),
+        max_connections=int(os.environ.get('MAX_CONNECTIONS', 256)),
+        max_connections_per_ip=int(os.environ.get('MAX_CONNECTIONS_PER_IP', 32)),
+        upstream_routes=parse_upstream_routes(upstream_routes) if upstream_routes else None,
+        sticky_sessions=os.environ.get('STICKY_SESSIONS') == '1',
+        drain_timeout=float(os.environ.get('DRAIN_TIMEOUT', 25.0)),
+        tls=tls,
+        capture_file=os.environ.get('CAPTURE_FILE')
+    )
+    
+    # SIGTERM: 优雅停止；SIGHUP: 热重启
+    signal.signal(signal.SIGTERM, lambda signum, frame: proxy.stop())
+    signal.signal(signal.SIGHUP, lambda signum, frame: proxy.hot_restart())
+    
+    # SIGUSR1: 开始/结束请求采样分析；SIGUSR2: 开始/结束内存跟踪
+    def toggle_profiler(signum, frame):
+        if proxy.profiler.active:
+            proxy.profiler.stop()
+        else:
+            proxy.profiler.start()
+    
+    def toggle_memory_tracer(signum, frame):
+        if proxy.memory_tracer.status()['active']:
+            proxy.memory_tracer.stop()
+        else:
+            proxy.memory_tracer.start()
+    
+    signal.signal(signal.SIGUSR1, toggle_profiler)
+    signal.signal(signal.SIGUSR2, toggle_memory_tracer)
+    
     try:
         proxy.start()
     except KeyboardInterrupt:
         print("\n正在停止HTTP VPN转发器...")
         proxy.stop()
+    
+    if proxy.successor_pid and os.getpid() == 1:
+        # 容器的PID 1退出会导致容器停止，交出服务后继续守护新进程
+        print(f"转发器已交由 PID {proxy.successor_pid} 接管")
+        reap_successors()
+    else:
         print("转发器已停止") 
\ No newline at end of file